@@ -122,7 +122,13 @@ def parse_args():
     local_inputs.add_argument('--directed', action='store_true', help='View graph as directed. (action store_true)')
 
     used_names = set()
-    choices = {'measurement': ('katz', 'cn', 'rpr', 'aa')}
+    choices = {'measurement': ('katz', 'cn', 'rpr', 'aa'),
+               'proximity_solver': ('neumann', 'lu'),
+               'svd_solver': ('arpack', 'randomized'),
+               'power_mode': ('dense', 'sparse', 'streamed'),
+               'eigen_solver': ('dense', 'svds', 'lanczos', 'shift_invert', 'lobpcg'),
+               'optimizer': ('adam', 'sgd'),
+               'feature_reduce': ('none', 'svd', 'random_projection', 'hashing')}
     # structure & training args
     generalgroup = parser.add_argument_group("GENERAL MODEL ARGUMENTS")
     no_default_args = ['epochs', 'output', ]
@@ -148,6 +154,8 @@ def parse_args():
     general_names = used_names.copy()
     tmp_used_names = {}
     addarg('sparse', generalgroup, used_names, False, True, '(in lle, gcn, gae, vgae)')
+    addarg('per_component', generalgroup, used_names, False, True, '(in lap, lle, hope)')
+    addarg('optimizer', generalgroup, used_names, 'adam', False, '(in gf)', choices)
     for modelname in simpledict:
         model = simpledict[modelname]
         model_args = model.args()
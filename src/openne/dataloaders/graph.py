@@ -8,9 +8,11 @@ import collections
 import os.path as osp
 import networkx as nx
 import numpy as np
+import scipy.sparse as sp
 import os
 import urllib
 import errno
+import hashlib
 from ..utils import *
 
 
@@ -88,9 +90,17 @@ class Graph(Dataset, ABC):
     def attributed(cls):
         raise NotImplementedError
 
-    def features(self):
-        return np.vstack([self.G.nodes[self.look_back_list[i]]['feature']
-                          for i in range(self.G.number_of_nodes())])
+    def features(self, sparse=False):
+        rows = [np.asarray(self.G.nodes[self.look_back_list[i]]['feature']).ravel()
+                for i in range(self.G.number_of_nodes())]
+        if not sparse:
+            return np.vstack(rows)
+        # row by row, so that bag-of-words features are never held as one dense matrix
+        indices = [np.flatnonzero(row) for row in rows]
+        indptr = np.concatenate(([0], np.cumsum([len(i) for i in indices])))
+        data = np.concatenate([row[i] for row, i in zip(rows, indices)]) if rows else np.zeros(0)
+        return sp.csr_matrix((data, np.concatenate(indices) if rows else np.zeros(0, dtype=np.int64), indptr),
+                             shape=(len(rows), len(rows[0]) if rows else 0))
 
     def adjmat(self, directed, weighted, scaled=None, sparse=False):
         G = self.G
@@ -113,6 +123,19 @@ class Graph(Dataset, ABC):
             Y.append(self.G.nodes[i]['label'])
         return X, Y
 
+    def fingerprint(self):
+        """
+        Digest of node order, edges and edge weights.
+        Used as a cache key by models that reuse preprocessing results across runs.
+        """
+        look_up = self.look_up_dict
+        h = hashlib.sha1()
+        h.update('\n'.join(str(node) for node in self.look_back_list).encode())
+        edges = np.array([(look_up[u], look_up[v], w) for u, v, w in self.G.edges.data('weight', default=1.0)],
+                         dtype=np.float64)
+        h.update(edges.tobytes())
+        return h.hexdigest()
+
     @property
     def nodesize(self):
         return self.G.number_of_nodes()
@@ -0,0 +1,63 @@
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.csgraph import connected_components
+
+
+def connected_blocks(adj):
+    """
+        Node indices of the (weakly) connected components of a scipy sparse adjacency, largest first.
+    """
+    n_components, labels = connected_components(adj, directed=True, connection='weak')
+    order = np.argsort(labels, kind='stable')
+    bounds = np.cumsum(np.bincount(labels, minlength=n_components))[:-1]
+    blocks = np.split(order, bounds)
+    blocks.sort(key=len, reverse=True)
+    return blocks
+
+
+def use_dense(size, k):
+    """ components this small are solved exactly with a dense decomposition in the calling process """
+    return size <= max(4 * k, 256)
+
+
+def solve_components(solve, adj, blocks, k, args=(), workers=1):
+    """
+        solve(sub_adjacency, k, *args) -> (values, [per-node factor matrices]) for every block. Blocks too
+        large for use_dense() run in `workers` processes, the rest in the calling process.
+        Results are in block order.
+    """
+    adj = sp.csr_matrix(adj)
+    subs = [adj[block][:, block] for block in blocks]
+    large = [i for i, block in enumerate(blocks) if not use_dense(len(block), k)]
+    results = [None] * len(blocks)
+    if workers > 1 and len(large) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(large))) as pool:
+            futures = {i: pool.submit(solve, subs[i], k, *args) for i in large}
+            for i in range(len(blocks)):  # small ones meanwhile
+                if i not in futures:
+                    results[i] = solve(subs[i], k, *args)
+            for i, future in futures.items():
+                results[i] = future.result()
+    else:
+        results = [solve(sub, k, *args) for sub in subs]
+    return results
+
+
+def select_columns(blocks, results, node_size, count, largest=False):
+    """
+        A block-diagonal matrix has the union of its blocks' eigen/singular pairs, zero-padded to all nodes.
+        Picks the `count` smallest (or largest) values over all components and assembles the factor
+        matrices (node_size, count) with columns in ascending order of value.
+    """
+    entries = [(value, b, j) for b, (values, _) in enumerate(results) for j, value in enumerate(values)]
+    if len(entries) < count:
+        raise ValueError("The components provide only {} informative dimensions, {} requested.".format(
+            len(entries), count))
+    entries.sort(key=lambda e: e[0], reverse=largest)
+    entries = sorted(entries[:count], key=lambda e: e[0])
+    outs = [np.zeros((node_size, count)) for _ in results[0][1]]
+    for col, (_, b, j) in enumerate(entries):
+        for out, factor in zip(outs, results[b][1]):
+            out[blocks[b], col] = factor[:, j]
+    return outs
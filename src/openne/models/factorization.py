@@ -0,0 +1,292 @@
+import hashlib
+import math
+import os
+import os.path as osp
+from time import time
+import numpy as np
+import scipy.sparse as sp
+import scipy.sparse.linalg as sla
+import torch
+from ..utils import check_existance, check_range, makedirs
+
+SVD_SOLVERS = ['arpack', 'randomized']
+# which='SM' with the randomized solver: subspace iterations continue until the eigen-residual of
+# A^T A, relative to ||A||^2, is below SM_TOL (at most SM_MAX_ITERS), otherwise arpack is used
+SM_TOL = 1e-6
+SM_MAX_ITERS = 300
+EIGEN_SOLVERS = ['lanczos', 'shift_invert', 'lobpcg']
+
+
+def check_svd_parameters(kwargs):
+    """ Defaults and ranges of the svd options shared by the spectral models. """
+    check_existance(kwargs, {'svd_solver': 'arpack',
+                             'svd_oversample': 10,
+                             'svd_power_iters': 4})
+    check_range(kwargs, {'svd_solver': SVD_SOLVERS,
+                         'svd_oversample': (0, np.inf),
+                         'svd_power_iters': (0, np.inf)})
+
+
+def svd_options(kwargs):
+    """ svds() keyword arguments from the model options svd_solver, svd_oversample and svd_power_iters """
+    return {'solver': kwargs.get('svd_solver', 'arpack'),
+            'oversample': kwargs.get('svd_oversample', 10),
+            'power_iters': kwargs.get('svd_power_iters', 4)}
+
+
+def check_cache_parameters(kwargs):
+    """ Defaults of the factorization cache options shared by the spectral models. """
+    check_existance(kwargs, {'factorization_cache': None,
+                             'cache_dim': None})
+    if kwargs['cache_dim'] is not None:
+        kwargs['cache_dim'] = int(kwargs['cache_dim'])
+        check_range(kwargs, {'cache_dim': 'positive'})
+
+
+class FactorizationCache:
+    """
+        On-disk cache of the factors of a spectral model, for sweeps over dim.
+
+        Entries are keyed by the graph fingerprint, the model name and the parameters that
+        determine the factorization (everything except its rank). An entry holds the factors at
+        the largest rank computed so far; smaller ranks are served by truncating them, which the
+        model does since the layout of its factors is its own.
+        With root=None nothing is cached and factors are computed at the requested rank.
+        Numpy factors are stored as tensors, so entries load with torch.load(weights_only=True).
+    """
+    def __init__(self, root, graph, model, silent=False, **key):
+        self.silent = silent
+        self.path = None
+        if root is not None:
+            digest = hashlib.sha1('{}{}{}'.format(graph.fingerprint(), model, sorted(key.items())).encode())
+            makedirs(osp.abspath(root))
+            self.path = osp.join(osp.abspath(root), '{}_{}.pt'.format(model, digest.hexdigest()))
+
+    def get(self, rank, compute, cache_rank=None):
+        """
+            Factors at rank >= `rank`: the cached ones if they are large enough, otherwise
+            compute(max(rank, cache_rank)), which are then cached for later runs.
+        """
+        if self.path is None:
+            return compute(rank)
+        if osp.isfile(self.path):
+            entry = torch.load(self.path)
+            if entry['rank'] >= rank:
+                self.debug("Using rank {} factors from cache {}".format(entry['rank'], self.path))
+                return self._from_tensors(entry['factors'])
+        rank = max(rank, cache_rank or 0)
+        factors = compute(rank)
+        tmp = '{}.{}.tmp'.format(self.path, os.getpid())
+        torch.save({'rank': rank, 'factors': self._to_tensors(factors)}, tmp)
+        os.replace(tmp, self.path)  # atomic, so concurrent runs never read partial files
+        return factors
+
+    @classmethod
+    def _to_tensors(cls, factors):
+        """ numpy arrays (in nested lists / tuples) -> {'ndarray': tensor}, the rest unchanged """
+        if isinstance(factors, np.ndarray):
+            return {'ndarray': torch.from_numpy(np.ascontiguousarray(factors))}
+        if isinstance(factors, (list, tuple)):
+            return type(factors)(cls._to_tensors(f) for f in factors)
+        return factors
+
+    @classmethod
+    def _from_tensors(cls, factors):
+        if isinstance(factors, dict) and 'ndarray' in factors:
+            return factors['ndarray'].numpy()
+        if isinstance(factors, (list, tuple)):
+            return type(factors)(cls._from_tensors(f) for f in factors)
+        return factors
+
+    def debug(self, *args, **kwargs):
+        if not self.silent:
+            print(*args, **kwargs)
+
+
+class _Operand:
+    """
+        Products A @ X and A^T @ X on float64 torch tensors, for dense (numpy / torch),
+        scipy sparse and LinearOperator inputs. Dense and sparse products run in torch, multithreaded.
+    """
+    def __init__(self, A):
+        self.shape = A.shape
+        self.op = None
+        if isinstance(A, sla.LinearOperator):
+            self.op = A
+        elif sp.issparse(A):
+            self.A = self._sparse(A)
+            self.At = self._sparse(A.T)
+        else:
+            self.A = torch.as_tensor(np.asarray(A) if not torch.is_tensor(A) else A, dtype=torch.float64)
+            self.At = self.A.t()
+
+    @staticmethod
+    def _sparse(A):
+        A = A.tocoo()
+        index = torch.from_numpy(np.vstack((A.row, A.col)).astype(np.int64))
+        return torch.sparse_coo_tensor(index, torch.from_numpy(A.data.astype(np.float64)), A.shape).coalesce()
+
+    def mm(self, X):
+        if self.op is not None:
+            return torch.from_numpy(np.asarray(self.op.matmat(X.numpy()), dtype=np.float64))
+        return torch.mm(self.A, X)
+
+    def rmm(self, X):
+        if self.op is not None:
+            return torch.from_numpy(np.asarray(self.op.rmatmat(X.numpy()), dtype=np.float64))
+        return torch.mm(self.At, X)
+
+
+def _has_linalg(name):
+    return hasattr(torch, 'linalg') and hasattr(torch.linalg, name)
+
+
+def _orthonormal(Y):
+    return torch.linalg.qr(Y)[0] if _has_linalg('qr') else torch.qr(Y)[0]
+
+
+def _eigh(T):
+    """ eigenvalues (ascending) and eigenvectors of the symmetric part of T """
+    T = (T + T.t()) / 2
+    return torch.linalg.eigh(T) if _has_linalg('eigh') else torch.symeig(T, eigenvectors=True)
+
+
+def _randn(rows, cols, generator):
+    return torch.randn(rows, cols, dtype=torch.float64, generator=generator)
+
+
+def _norm_estimate(A, generator, iters=20):
+    """ ||A||_2 by power iteration on A^T A, slightly enlarged to be an upper bound in practice. """
+    x = _randn(A.shape[1], 1, generator)
+    sigma = 0.
+    for _ in range(iters):
+        x = x / max(float(x.norm()), 1e-300)
+        y = A.rmm(A.mm(x))
+        sigma = math.sqrt(float(y.norm()))
+        x = y
+    return sigma * 1.05
+
+
+def _randomized_top(A, k, oversample, power_iters, generator):
+    """ Halko, Martinsson & Tropp (2011), Alg. 4.4 + 5.1 """
+    Q = _orthonormal(A.mm(_randn(A.shape[1], k + oversample, generator)))
+    for _ in range(power_iters):
+        Q = _orthonormal(A.mm(_orthonormal(A.rmm(Q))))
+    Bt = A.rmm(Q)  # B = Q^T A, kept transposed
+    V, s, Ubt = torch.svd(Bt)  # Bt = V diag(s) Ub^T
+    U = torch.mm(Q, Ubt)
+    return U[:, :k], s[:k], V[:, :k].t(), Q
+
+
+def _randomized_bottom(A, k, oversample, power_iters, generator, tol=SM_TOL, max_iters=SM_MAX_ITERS):
+    """
+        Smallest singular triplets as the top eigenvectors of the shifted operator c I - A^T A,
+        with c >= ||A||_2^2, by subspace iteration with Rayleigh-Ritz steps. The wanted part of the
+        shifted spectrum is clustered near c, so after power_iters iterations it continues, checking
+        every few iterations, until max_i ||A^T A v_i - s_i^2 v_i|| <= tol * c or max_iters is reached.
+        Also returns that relative residual.
+    """
+    c = _norm_estimate(A, generator) ** 2
+    shifted = lambda X: c * X - A.rmm(A.mm(X))
+    Q = _orthonormal(shifted(_randn(A.shape[1], k + oversample, generator)))
+    iters, steps = 0, power_iters
+    while True:
+        for _ in range(steps):
+            Q = _orthonormal(shifted(Q))
+        iters += steps
+        SQ = shifted(Q)
+        lam, W = _eigh(torch.mm(Q.t(), SQ))
+        order = torch.argsort(lam, descending=True)[:k]
+        V = torch.mm(Q, W[:, order])
+        err = float((torch.mm(SQ, W[:, order]) - V * lam[order]).norm(dim=0).max()) / max(c, 1e-300)
+        if err <= tol or iters >= max_iters:
+            break
+        steps = 5
+    s = torch.sqrt(torch.clamp(c - lam[order], min=0.))
+    AV = A.mm(V)
+    U = AV / torch.where(s > 0, s, torch.ones_like(s))
+    return U, s, V.t(), err
+
+
+def _residual(A, U, s, Vt):
+    """ max_i ||A v_i - s_i u_i|| relative to the largest returned singular value """
+    R = A.mm(Vt.t()) - U * s
+    return float(R.norm(dim=0).max()) / max(float(s.max()), 1e-300)
+
+
+def _range_error(A, Q, generator, probes=10):
+    """ a-posteriori bound on ||(I - Q Q^T) A||_2, Halko et al. (2011), eq. 4.3; holds w.p. 1 - 10^-probes """
+    W = A.mm(_randn(A.shape[1], probes, generator))
+    W = W - torch.mm(Q, torch.mm(Q.t(), W))
+    return 10 * math.sqrt(2 / math.pi) * float(W.norm(dim=0).max())
+
+
+def svds(A, k, *, which='LM', solver='arpack', oversample=10, power_iters=4, seed=None, debug=None):
+    """
+        Truncated SVD of A (dense, scipy sparse or LinearOperator), a drop-in for
+        scipy.sparse.linalg.svds: returns u, s, vt as numpy arrays with s in ascending order.
+        :param which: 'LM' for the largest singular values, 'SM' for the smallest.
+        :param solver: 'arpack' (scipy.sparse.linalg.svds) or 'randomized' (Halko et al., with
+            `oversample` extra columns and `power_iters` subspace iterations, block products in torch).
+        :param debug: if given, called with one line reporting the time and the accuracy of the result.
+    """
+    if solver not in SVD_SOLVERS:
+        raise ValueError("svd solver {} not in {}".format(solver, SVD_SOLVERS))
+    t0 = time()
+    if solver == 'arpack':
+        u, s, vt = sla.svds(A, k=k, which=which)
+        order = np.argsort(s)
+        u, s, vt = u[:, order], s[order], vt[order]
+        if debug is not None:
+            op = _Operand(A)
+            err = _residual(op, *(torch.from_numpy(np.asarray(x, dtype=np.float64)) for x in (u, s, vt)))
+            debug("arpack svd (k={}, which={}): {:.2f}s, relative residual {:.2e}".format(
+                k, which, time() - t0, err))
+        return u, s, vt
+    generator = torch.Generator()
+    generator.manual_seed(int(torch.randint(1 << 31, (1,))) if seed is None else seed)
+    op = _Operand(A)
+    k_max = min(op.shape)
+    oversample = max(0, min(oversample, k_max - k))
+    Q = None
+    if which == 'SM':
+        U, s, Vt, err = _randomized_bottom(op, k, oversample, power_iters, generator)
+        if err > SM_TOL:
+            if debug is not None:
+                debug("randomized svd (k={}, which=SM): eigen-residual {:.2e} after {} iterations, "
+                      "falling back to arpack".format(k, err, SM_MAX_ITERS))
+            return svds(A, k, which=which, solver='arpack', debug=debug)
+    else:
+        U, s, Vt, Q = _randomized_top(op, k, oversample, power_iters, generator)
+    if debug is not None:
+        elapsed = time() - t0
+        line = "randomized svd (k={}, which={}, oversample={}, power_iters={}): {:.2f}s, " \
+               "relative residual {:.2e}".format(k, which, oversample, power_iters, elapsed,
+                                                 _residual(op, U, s, Vt))
+        if Q is not None:
+            line += ", range error bound {:.2e}".format(_range_error(op, Q, generator))
+        debug(line)
+    order = torch.argsort(s)
+    return U[:, order].numpy(), s[order].numpy(), Vt[order].numpy()
+
+
+def smallest_eigenpairs(L, k, solver='lanczos', tol=1e-8, seed=None):
+    """
+        The k smallest eigenpairs of a sparse symmetric PSD matrix L, eigenvalues in ascending order.
+        'lanczos': implicitly restarted Lanczos (eigsh) for the smallest algebraic eigenvalues;
+        'shift_invert': eigsh around a small negative shift, one sparse LU of L + 0.01 I, fastest convergence;
+        'lobpcg': block LOBPCG from a random start with a Jacobi preconditioner, only sparse products.
+    """
+    if solver not in EIGEN_SOLVERS:
+        raise ValueError("eigen solver {} not in {}".format(solver, EIGEN_SOLVERS))
+    if solver == 'shift_invert':
+        w, vec = sla.eigsh(L, k=k, sigma=-1e-2, which='LM', tol=tol)
+    elif solver == 'lobpcg':
+        X = np.random.RandomState(seed).standard_normal((L.shape[0], k))
+        diagonal = L.diagonal()
+        jacobi = sp.diags(np.divide(1., diagonal, out=np.ones_like(diagonal), where=diagonal > 0))
+        w, vec = sla.lobpcg(L, X, M=jacobi, largest=False, tol=tol, maxiter=max(200, k))
+    else:
+        w, vec = sla.eigsh(L, k=k, which='SA', tol=tol)
+    order = np.argsort(w)
+    return w[order], vec[:, order]
@@ -0,0 +1,82 @@
+import hashlib
+import numpy as np
+import scipy.sparse as sp
+from ..utils import *
+from .factorization import svds, svd_options
+
+FEATURE_REDUCTIONS = ['none', 'svd', 'random_projection', 'hashing']
+
+
+def check_feature_parameters(kwargs, feature_reduce='none'):
+    """ Defaults and ranges of the feature reduction options shared by the attributed models. """
+    check_existance(kwargs, {'feature_reduce': feature_reduce,
+                             'feature_dim': 200})
+    check_range(kwargs, {'feature_reduce': FEATURE_REDUCTIONS,
+                         'feature_dim': 'positive'})
+
+
+def _row_normalized(X):
+    rowsum = np.asarray(X.sum(1)).ravel()
+    return sp.diags(np.divide(1., rowsum, out=np.zeros_like(rowsum), where=rowsum != 0)) @ X
+
+
+def _random_projection(X, dim, rng):
+    """ very sparse random projection (Li, Hastie & Church, 2006): entries +-sqrt(s / dim) with density 1 / s """
+    s = np.sqrt(X.shape[1])
+    R = sp.random(X.shape[1], dim, density=1 / s, format='csr', random_state=rng,
+                  data_rvs=lambda n: rng.choice([-1., 1.], n))
+    return X @ R * np.sqrt(s / dim)
+
+
+def _hashing(X, dim, rng):
+    """ feature hashing: every column is added, with a random sign, to one of dim buckets """
+    f = X.shape[1]
+    H = sp.csr_matrix((rng.choice([-1., 1.], f), (np.arange(f), rng.randint(dim, size=f))), shape=(f, dim))
+    return X @ H
+
+
+def reduced_features(graph, feature_reduce='none', feature_dim=200, row_normalize=False, seed=0, debug=None,
+                     **kwargs):
+    """
+        Node features (node_size, feature_dim) in look_back_list order, reduced without densifying the
+        raw feature matrix: 'svd' (U * S of its truncated SVD, see --svd-solver), 'random_projection'
+        or 'hashing'. Features that are not wider than feature_dim are returned as they are.
+        With row_normalize, rows are scaled to sum 1 first, as GCN's preprocess_features does.
+
+        Reduced features are cached as .npy files in the dataset directory, keyed by the graph
+        fingerprint, a digest of the features and the reduction options.
+    """
+    X = graph.features(sparse=True).astype(np.float64)
+    if row_normalize:
+        X = sp.csr_matrix(_row_normalized(X))
+    if feature_reduce == 'none' or X.shape[1] <= feature_dim:
+        return X.toarray().astype(np.float32)
+
+    options = svd_options(kwargs) if feature_reduce == 'svd' else {}
+    key = hashlib.sha1()
+    key.update('{}{}'.format(graph.fingerprint(), sorted(dict(options, method=feature_reduce, dim=feature_dim,
+                                                              row_normalize=row_normalize, seed=seed,
+                                                              shape=X.shape).items())).encode())
+    for array in (X.indptr, X.indices, X.data):
+        key.update(array.tobytes())
+    cache = osp.join(graph.dir, 'reduced_features', key.hexdigest() + '.npy') if graph.dir else None
+    if cache is not None and osp.isfile(cache):
+        if debug is not None:
+            debug("Loading {} features ({} -> {}) from {}".format(feature_reduce, X.shape[1], feature_dim, cache))
+        return np.load(cache)
+
+    rng = np.random.RandomState(seed)
+    if feature_reduce == 'svd':
+        U, S, _ = svds(X, k=feature_dim, seed=seed, debug=debug, **options)
+        reduced = (U * S)[:, ::-1]
+    elif feature_reduce == 'random_projection':
+        reduced = _random_projection(X, feature_dim, rng)
+    else:
+        reduced = _hashing(X, feature_dim, rng)
+    reduced = np.ascontiguousarray(reduced.toarray() if sp.issparse(reduced) else reduced, dtype=np.float32)
+    if cache is not None:
+        makedirs(osp.dirname(cache))
+        tmp = '{}.{}.tmp.npy'.format(cache[:-len('.npy')], os.getpid())
+        np.save(tmp, reduced)
+        os.replace(tmp, cache)  # atomic, so concurrent runs never read partial files
+    return reduced
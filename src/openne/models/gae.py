@@ -2,6 +2,7 @@ import numpy as np
 from .gcn.utils import *
 from .gcn.layers import GraphConvolution
 from .models import *
+from .features import reduced_features, check_feature_parameters
 import time
 import scipy.sparse as sp
 import torch
@@ -16,15 +17,22 @@ class GAEModel(nn.Module):
         self.adj = adj
         self.layers = nn.ModuleList()
         for i in range(1, len(self.dimensions) - 1):
-            self.layers.append(GraphConvolution(self.dimensions[i - 1], self.dimensions[i], dropout, act=F.relu))
-        self.layers.append(GraphConvolution(self.dimensions[-2], self.dimensions[-1], dropout, act=lambda x: x))
+            self.layers.append(GraphConvolution(self.dimensions[i - 1], self.dimensions[i], [self.adj], dropout,
+                                                act=F.relu))
+        self.layers.append(GraphConvolution(self.dimensions[-2], self.dimensions[-1], [self.adj], dropout,
+                                            act=lambda x: x))
 
     def forward(self, x):
         output = x
         for layer in self.layers:
-            output = layer(output, self.adj)
+            output = layer(output)
         return output
 
+    def forward_blocks(self, x, chunk_size):
+        for layer in self.layers[:-1]:
+            x = layer(x)
+        return self.layers[-1].forward_blocks(x, chunk_size)
+
 
 class GAE(ModelWithEmbeddings):
 
@@ -50,6 +58,7 @@ class GAE(ModelWithEmbeddings):
                              "early_stopping": (0, np.inf),
                              "clf_ratio": (0, 1),
                              "max_degree": (0, np.inf)})
+        check_feature_parameters(kwargs)
         return kwargs
 
     @classmethod
@@ -75,7 +84,7 @@ class GAE(ModelWithEmbeddings):
         self.dropout = dropout
         self.weight_decay = weight_decay
         self.early_stopping = early_stopping
-        self.preprocess_data(graph)
+        self.preprocess_data(graph, **kwargs)
         # Create models
         input_dim = self.features.shape[1]
 
@@ -131,17 +140,18 @@ class GAE(ModelWithEmbeddings):
             self.optimizer.step()
         return output, loss, (time.time() - t_test)
 
-    def _get_embeddings(self, graph, **kwargs):
-        self.embeddings = self.model(self.features).detach()
+    def embedding_blocks(self, graph, chunk_size, **kwargs):
+        return self.model.forward_blocks(self.features, chunk_size)
 
-    def preprocess_data(self, graph):
+    def preprocess_data(self, graph, **kwargs):
         """
             adj, features, y_train, y_val, y_test, train_mask, val_mask, test_mask
             y_train, y_val, y_test can merge to y
         """
         g = graph.G
-        features = torch.from_numpy(graph.features()).type(torch.float32)
-        features = preprocess_features(features, sparse=self.sparse)
+        # row-normalized (see preprocess_features) and optionally reduced, see --feature-reduce
+        features = torch.from_numpy(reduced_features(graph, row_normalize=True, debug=self.debug, **kwargs))
+        features = features.to_sparse() if self.sparse else features
         self.register_buffer("features", features)
         n = graph.nodesize
         self.build_label(graph)
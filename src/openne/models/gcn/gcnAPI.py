@@ -2,6 +2,7 @@ import numpy as np
 from .utils import *
 from . import gcnModel
 from ..models import *
+from ..features import reduced_features, check_feature_parameters
 import time
 import scipy.sparse as sp
 import torch
@@ -32,6 +33,7 @@ class GCN(ModelWithEmbeddings):
                              "early_stopping": (0, np.inf),
                              "clf_ratio": (0, 1),
                              "max_degree": (0, np.inf)})
+        check_feature_parameters(kwargs)
         return kwargs
 
     @classmethod
@@ -60,7 +62,7 @@ class GCN(ModelWithEmbeddings):
         self.sparse = sparse
 
 
-        self.preprocess_data(graph)
+        self.preprocess_data(graph, **kwargs)
         # Create models
         input_dim = self.features.shape[1]  # row
         if self.sparse:
@@ -80,8 +82,8 @@ class GCN(ModelWithEmbeddings):
         self.debug_info = "train_loss = {:.5f}, train_acc = {:.5f}".format(train_loss, train_acc)
         return output
 
-    def _get_embeddings(self, graph, **kwargs):
-        self.embeddings = self.model(self.features).detach()
+    def embedding_blocks(self, graph, chunk_size, **kwargs):
+        return self.model.forward_blocks(self.features, chunk_size)
 
     def early_stopping_judge(self, graph, *, step=0, **kwargs):
         return kwargs['validate'] and step > self.early_stopping and self.cost_val[-1] > torch.mean(
@@ -125,14 +127,15 @@ class GCN(ModelWithEmbeddings):
                 l_id = label_dict[ll]
                 self.labels[node_id, l_id] = 1
 
-    def preprocess_data(self, graph):
+    def preprocess_data(self, graph, **kwargs):
         """
             adj, features, y_train, y_val, y_test, train_mask, val_mask, test_mask
             y_train, y_val, y_test can merge to y
         """
         g = graph.G
-        features = torch.from_numpy(graph.features()).type(torch.float32)
-        features = preprocess_features(features, sparse=self.sparse)
+        # row-normalized (see preprocess_features) and optionally reduced, see --feature-reduce
+        features = torch.from_numpy(reduced_features(graph, row_normalize=True, debug=self.debug, **kwargs))
+        features = features.to_sparse() if self.sparse else features
         self.register_buffer("features", features)
         self.build_label(graph)
         adj = graph.adjmat(weighted=True, directed=True)
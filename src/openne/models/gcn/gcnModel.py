@@ -48,6 +48,16 @@ class Model(torch.nn.Module):
         self.output = self.sequential(inputs)
         return self.output
 
+    def forward_blocks(self, inputs, chunk_size):
+        """
+            forward(inputs) in blocks of chunk_size rows. Hidden layers run once;
+            only the output layer, the widest one for most graphs, is computed per block.
+        """
+        x = inputs
+        for layer in self.layers[:-1]:
+            x = layer(x)
+        return self.layers[-1].forward_blocks(x, chunk_size)
+
     def loss(self, *args):
         raise NotImplementedError
 
@@ -99,7 +99,7 @@ class GraphConvolution(Layer):
         if self.logging:
             self._log_vars()
 
-    def forward(self, inputs=None):
+    def _pre_sups(self, inputs):
         x = inputs
         if not self.featureless and self.training:
             # dropout
@@ -107,15 +107,20 @@ class GraphConvolution(Layer):
                 x = sparse_dropout(x, self.dropout, self.num_features_nonzero)
             else:
                 x = torch.dropout(x, self.dropout,True)
-
-        # convolve
-        output = torch.zeros([self.support[0].size()[0], self.output_dim], device=x.device)
+        pre_sups = []
         for i in range(len(self.support)):
             if not self.featureless:
-                pre_sup = torch.mm(x, getattr(self, 'weights_' + str(i)))
+                pre_sups.append(torch.mm(x, getattr(self, 'weights_' + str(i))))
             else:
-                pre_sup = getattr(self, 'weights_' + str(i))
-            support = torch.mm(self.support[i], pre_sup)
+                pre_sups.append(getattr(self, 'weights_' + str(i)))
+        return pre_sups
+
+    def forward(self, inputs=None):
+        # convolve
+        pre_sups = self._pre_sups(inputs)
+        output = torch.zeros([self.support[0].size()[0], self.output_dim], device=pre_sups[0].device)
+        for i in range(len(self.support)):
+            support = torch.mm(self.support[i], pre_sups[i])
             output += support
 
         # bias
@@ -123,3 +128,40 @@ class GraphConvolution(Layer):
             output += self.bias
         return self.act(output)
 
+    def _support_rows(self, i, start, length):
+        """
+            Rows start .. start + length of support i. Sparse supports are coalesced (row-major) once and
+            indexed by a row pointer, so a block only touches its own entries.
+        """
+        s = self.support[i]
+        if not s.is_sparse:
+            return s[start:start + length]
+        if not hasattr(self, '_row_index'):
+            self._row_index = {}
+        if i not in self._row_index:
+            s = s.coalesce()
+            rows = s.indices()[0]
+            row_ptr = torch.zeros(s.size()[0] + 1, dtype=torch.long, device=rows.device)
+            row_ptr[1:] = torch.cumsum(torch.bincount(rows, minlength=s.size()[0]), 0)
+            self._row_index[i] = (s.indices(), s.values(), row_ptr.cpu())
+        indices, values, row_ptr = self._row_index[i]
+        begin, end = int(row_ptr[start]), int(row_ptr[start + length])
+        block_indices = indices[:, begin:end] - torch.tensor([[start], [0]], device=indices.device)
+        return torch.sparse_coo_tensor(block_indices, values[begin:end], (length, s.size()[1]))
+
+    def forward_blocks(self, inputs, chunk_size):
+        """
+            forward(inputs) in blocks of chunk_size output rows. x W is computed once; each block
+            multiplies only its rows of the supports with it.
+        """
+        pre_sups = self._pre_sups(inputs)
+        node_size = self.support[0].size()[0]
+        for start in range(0, node_size, chunk_size):
+            length = min(chunk_size, node_size - start)
+            output = torch.zeros([length, self.output_dim], device=pre_sups[0].device)
+            for i in range(len(self.support)):
+                output += torch.mm(self._support_rows(i, start, length), pre_sups[i])
+            if self.bias is not None:
+                output += self.bias
+            yield self.act(output)
+
@@ -1,8 +1,12 @@
 from __future__ import print_function
+import random
 import torch
+import torch.nn as nn
 import numpy as np
+import scipy.sparse as sp
 from .models import *
 from ..utils import *
+from .hogwild import HogwildWorker, worker_threads
 
 __author__ = "Wang Binlu"
 __email__ = "wblmail@whu.edu.cn"
@@ -16,27 +20,87 @@ class GraphFactorization(ModelWithEmbeddings):
 
     @classmethod
     def check_train_parameters(cls, **kwargs):
-        check_existance(kwargs, {'epochs': 130, 'lr': 0.003, 'weight_decay': 1., 'dim': 128})
+        check_existance(kwargs, {'epochs': 130, 'lr': 0.003, 'weight_decay': 1., 'dim': 128,
+                                 'batch_size': 4096,
+                                 'optimizer': 'adam',
+                                 'workers': 1})
         check_range(kwargs, {'epochs': 'positive', 'lr': 'positive',
-                             'weight_decay': 'positive', 'dim': 'positive'})
+                             'weight_decay': 'positive', 'dim': 'positive',
+                             'batch_size': 'positive',
+                             'optimizer': ['adam', 'sgd'],
+                             'workers': 'positive'})
         return kwargs
 
-    def build(self, graph, *, lr=0.003, **kwargs):
-        self.register_buffer('adj_mat', torch.from_numpy(graph.adjmat(directed=True, weighted=True)).to(torch.float32))
-        self.register_buffer('mat_mask', torch.as_tensor(self.adj_mat > 0, dtype=torch.float32))
+    def build(self, graph, *, lr=0.003, batch_size=4096, optimizer='adam', weight_decay=1., **kwargs):
+        # the loss only involves the observed entries of the adjacency, kept as an edge list
+        adj = sp.coo_matrix(graph.adjmat(directed=True, weighted=True, sparse=True))
+        self.edges = torch.from_numpy(np.vstack((adj.row, adj.col)).T.astype(np.int64))
+        self.weights = torch.from_numpy(adj.data.astype(np.float32))
+        # weight_decay * ||Z_i||^2 is spread over the occurrences of node i in the edge list, so that
+        # one epoch adds up to the regularizer of the full objective
+        occurrences = np.bincount(np.concatenate((adj.row, adj.col)), minlength=graph.nodesize)
+        self.reg_weights = torch.from_numpy(
+            weight_decay / np.maximum(occurrences, 1).astype(np.float32))
+        self.batch_size = batch_size
 
-        self.register_parameter('_embeddings', torch.nn.init.xavier_uniform_(torch.nn.Parameter(
-            torch.zeros(graph.nodesize, self.dim, dtype=torch.float32), True)))
-        # print(_embeddings)
-        self.optimizer = torch.optim.Adam([self._embeddings], lr=lr)
+        # sparse lookups: a step only touches (and keeps optimizer state for) the rows in the batch
+        self.node_embeddings = nn.Embedding(graph.nodesize, self.dim, sparse=True)
+        nn.init.xavier_uniform_(self.node_embeddings.weight)
+        if optimizer == 'sgd':  # plain SGD as in Ahmed et al. (2013)
+            self.optimizer = torch.optim.SGD(self.node_embeddings.parameters(), lr=lr)
+        else:
+            self.optimizer = torch.optim.SparseAdam(list(self.node_embeddings.parameters()), lr=lr)
 
-    def train_model(self, graph, *, weight_decay=1., **kwargs):
-        self.optimizer.zero_grad()
-        cost = ((self.adj_mat - torch.mm(self._embeddings, self._embeddings.t()) * self.mat_mask) ** 2).sum() + \
-               weight_decay * ((self._embeddings ** 2).sum())
-        cost.backward()
-        self.optimizer.step()
-        self.debug_info = "cost: {}".format(float(cost))
+    def after_build(self, graph, *, workers=1, **kwargs):
+        self._workers = []
+        if workers > 1 and kwargs.get('_device', torch.device('cpu')).type == 'cpu':
+            # Hogwild: embeddings in shared memory, every worker process has its own optimizer,
+            # takes 1/workers of the edges of an epoch and updates them lock-free
+            self.share_memory()
+            threads = worker_threads(workers)
+            self._workers = [HogwildWorker(self, rank, threads, random.getrandbits(32)) for rank in range(workers)]
+
+    def loss(self, index):
+        h, t = self.edges[index, 0].to(self._device), self.edges[index, 1].to(self._device)
+        zh, zt = self.node_embeddings(h), self.node_embeddings(t)
+        reg_weights = self.reg_weights.to(self._device)
+        return ((self.weights[index].to(self._device) - (zh * zt).sum(dim=1)) ** 2).sum() + \
+            (reg_weights[h] * (zh ** 2).sum(dim=1) + reg_weights[t] * (zt ** 2).sum(dim=1)).sum()
+
+    def run_epoch(self, rank, workers=1, seed=None):
+        """
+            One pass over the edges in random mini-batches, or this worker's shard of them when `workers`
+            Hogwild processes train the same embeddings: every worker draws the same permutation from
+            `seed` and takes its entries rank, rank + workers, ... Returns the sum of loss.
+        """
+        edge_size = len(self.edges)
+        if seed is None:
+            perm = torch.randperm(edge_size)
+        else:
+            perm = torch.randperm(edge_size, generator=torch.Generator().manual_seed(seed))
+        cost = 0.
+        for index in perm[rank::workers].split(self.batch_size):
+            self.optimizer.zero_grad()
+            batch_cost = self.loss(index)
+            batch_cost.backward()
+            self.optimizer.step()
+            cost += float(batch_cost)
+        return cost
+
+    def teardown(self, graph, **kwargs):
+        for worker in self._workers:
+            worker.close()
+        self._workers = []
+
+    def train_model(self, graph, **kwargs):
+        if self._workers:
+            seed = random.getrandbits(32)  # one permutation of the edges per epoch, sharded by rank
+            for worker in self._workers:
+                worker.call('run_epoch', len(self._workers), seed)
+            cost = sum(worker.result() for worker in self._workers)
+        else:
+            cost = self.run_epoch(0)
+        self.debug_info = "cost: {}".format(cost)
 
     def _get_embeddings(self, graph, **kwargs):
-        self.embeddings = self._embeddings.detach()
+        self.embeddings = self.node_embeddings.weight.detach()
@@ -1,8 +1,11 @@
+from concurrent.futures import ThreadPoolExecutor
 import torch
 import numpy as np
+import scipy.sparse as sp
 import scipy.sparse.linalg as lg
 from ..utils import *
 from .models import *
+from .factorization import svds, svd_options, check_svd_parameters, check_cache_parameters, FactorizationCache
 
 def GetProbTranMat(Ak, node_size):
     probTranMat = torch.log(Ak/torch.Tensor.repeat(
@@ -13,32 +16,189 @@ def GetProbTranMat(Ak, node_size):
     return probTranMat
 
 
+def log_transition(Ak, col_sum, node_size):
+    """
+        GetProbTranMat for a scipy sparse Ak, given its column sums. Only entries with
+        Ak_ij * N > col_sum_j are positive after the log, and all of them lie in the support of Ak,
+        so the result is at least as sparse as Ak.
+    """
+    Ak = Ak.tocoo()
+    val = np.log(Ak.data * node_size / col_sum[Ak.col])
+    keep = val > 0
+    return sp.csr_matrix((val[keep], (Ak.row[keep], Ak.col[keep])), shape=Ak.shape)
+
+
+def prune(Ak, tol):
+    if tol > 0:
+        Ak.data[Ak.data < tol] = 0
+        Ak.eliminate_zeros()
+    return Ak
+
+
+class StreamedLogTransition(lg.LinearOperator):
+    """
+        The log-transition matrix of step k as a LinearOperator. Each product recomputes it in blocks of
+        block_size rows (rows of A^k by sparse products, then log_transition), so at most one block is alive.
+    """
+    def __init__(self, adj, k, col_sum, block_size=1024, prune_tol=0.):
+        super(StreamedLogTransition, self).__init__(np.float64, adj.shape)
+        self.adj = adj
+        self.k = k
+        self.col_sum = col_sum
+        self.block_size = block_size
+        self.prune_tol = prune_tol
+
+    def blocks(self):
+        n = self.shape[0]
+        for start in range(0, n, self.block_size):
+            rows = self.adj[start:start + self.block_size]
+            for _ in range(self.k - 1):
+                rows = prune(rows @ self.adj, self.prune_tol)
+            yield start, log_transition(rows, self.col_sum, n)
+
+    def _matmat(self, X):
+        out = np.empty((self.shape[0], X.shape[1]))
+        for start, block in self.blocks():
+            out[start:start + block.shape[0]] = block @ X
+        return out
+
+    def _rmatmat(self, X):
+        out = np.zeros((self.shape[1], X.shape[1]))
+        for start, block in self.blocks():
+            out += block.T @ X[start:start + block.shape[0]]
+        return out
+
+    def _matvec(self, x):
+        return self._matmat(x.reshape(-1, 1)).ravel()
+
+    def _rmatvec(self, x):
+        return self._rmatmat(x.reshape(-1, 1)).ravel()
+
+
 class GraRep(ModelWithEmbeddings):
     def __init__(self, kstep, dim, **kwargs):
         super(GraRep, self).__init__(kstep=kstep, dim=int(dim/kstep), **kwargs)
 
     @classmethod
     def check_train_parameters(cls, **kwargs):
-        check_existance(kwargs, {'kstep': 4, 'dim': 128})
-        check_range(kwargs, {"kstep": 'positive', 'dim': 'positive'})
+        check_existance(kwargs, {'kstep': 4, 'dim': 128,
+                                 'power_mode': 'dense',
+                                 'block_size': 1024,
+                                 'prune_tol': 0.,
+                                 'svd_workers': None})
+        check_range(kwargs, {"kstep": 'positive', 'dim': 'positive',
+                             'power_mode': ['dense', 'sparse', 'streamed'],
+                             'block_size': 'positive',
+                             'prune_tol': (0, 1)})
         assert kwargs['dim'] % kwargs['kstep'] == 0
+        check_svd_parameters(kwargs)
+        if kwargs['svd_workers'] is None:
+            # scipy runs one ARPACK solve at a time, so concurrent arpack steps would only queue up
+            kwargs['svd_workers'] = 1 if kwargs['svd_solver'] == 'arpack' else 2
+        kwargs['svd_workers'] = int(kwargs['svd_workers'])
+        check_range(kwargs, {'svd_workers': 'positive'})
+        check_cache_parameters(kwargs)
         return kwargs
 
-    def GetRepUseSVD(self, probTranMat, alpha):
-        U, S, VT = lg.svds(probTranMat, k=self.dim)
-        Ud = torch.from_numpy(U)
-        Sd = torch.from_numpy(S)
+    def GetRepUseSVD(self, U, S, alpha):
+        # singular values are ascending: the top dim triplets are the last ones
+        Ud = torch.from_numpy(np.ascontiguousarray(U[:, -self.dim:]))
+        Sd = torch.from_numpy(np.ascontiguousarray(S[-self.dim:]))
         return torch.as_tensor(Ud)*torch.pow(Sd, alpha)
 
-    def train_model(self, graph, **kwargs):
+    def transition_matrix(self, graph):
+        """ row-normalized adjacency as scipy CSR; rows of isolated nodes stay zero """
+        adj = sp.csr_matrix(graph.adjmat(directed=False, weighted=False, sparse=True), dtype=np.float64)
+        degree = np.asarray(adj.sum(1)).ravel()
+        return (sp.diags(np.divide(1., degree, out=np.zeros_like(degree), where=degree > 0)) @ adj).tocsr()
+
+    def dense_log_transitions(self, graph):
         adj = torch.from_numpy(graph.adjmat(directed=False, weighted=False, scaled=1)).type(torch.float32)
         Ak = torch.eye(graph.nodesize)
-        RepMat = torch.zeros((graph.nodesize, int(self.dim * self.kstep)))
         for i in range(self.kstep):
             self.debug('kstep =', i)
             Ak = torch.mm(Ak, adj)
-            probTranMat = GetProbTranMat(Ak, graph.nodesize)
-            Rk = self.GetRepUseSVD(probTranMat, 0.5)
-            Rk = torch.nn.functional.normalize(Rk, p=2, dim=1)
-            RepMat[:, self.dim*i:self.dim*(i+1)] = Rk
+            yield GetProbTranMat(Ak, graph.nodesize)
+
+    def sparse_log_transitions(self, graph, power_mode='sparse', block_size=1024, prune_tol=0.):
+        """
+            power_mode='sparse' keeps A^k in CSR form (optionally dropping entries below prune_tol);
+            power_mode='streamed' never stores A^k, and the SVD runs on StreamedLogTransition.
+            Column sums of A^k come from vector-matrix products, 1^T A^k = (1^T A^(k-1)) A, so pruning
+            drops entries but does not shift the normalization of the ones it keeps.
+        """
+        n = graph.nodesize
+        adj = self.transition_matrix(graph)
+        col_sum = np.ones(n)
+        Ak = None
+        for i in range(self.kstep):
+            self.debug('kstep =', i)
+            col_sum = adj.T @ col_sum
+            if power_mode == 'sparse':
+                Ak = adj.copy() if Ak is None else prune(Ak @ adj, prune_tol)
+                probTranMat = log_transition(Ak, col_sum, n)  # exact sums, not those of the pruned A^k
+                self.debug('nnz of A^{}: {}, of its log-transition matrix: {}'.format(i + 1, Ak.nnz, probTranMat.nnz))
+                yield probTranMat
+            else:
+                yield StreamedLogTransition(adj, i + 1, col_sum, block_size, prune_tol)
+
+    def factorize_step(self, factors, i, probTranMat, rank, on_step=None, keep=True, **kwargs):
+        U, S, VT = svds(probTranMat, k=rank, debug=self.debug, **svd_options(kwargs))
+        if on_step is not None:
+            on_step(i, U, S)
+        if keep:
+            factors[i] = (U, S)
+
+    def factorize(self, graph, rank, power_mode='dense', block_size=1024, prune_tol=0., svd_workers=1, **kwargs):
+        """
+            (U, S) of the rank `rank` SVD of every step's log-transition matrix, S ascending.
+            The SVD of step k only needs its log-transition matrix, so it runs in a pool of svd_workers threads
+            while the next power is computed (numpy, scipy and torch release the GIL). At most svd_workers
+            steps are pending, which bounds the number of log-transition matrices alive at once.
+            on_step(i, U, S) is called as soon as step i is factorized; with keep=False its factors are
+            not collected (the returned list holds None).
+        """
+        if power_mode == 'dense':
+            steps = self.dense_log_transitions(graph)
+        else:
+            steps = self.sparse_log_transitions(graph, power_mode, block_size, prune_tol)
+        factors = [None] * self.kstep
+        if svd_workers <= 1:
+            for i, probTranMat in enumerate(steps):
+                self.factorize_step(factors, i, probTranMat, rank, **kwargs)
+            return factors
+        pending = []
+        with ThreadPoolExecutor(max_workers=svd_workers) as pool:
+            for i, probTranMat in enumerate(steps):
+                pending.append(pool.submit(self.factorize_step, factors, i, probTranMat, rank, **kwargs))
+                del probTranMat
+                if len(pending) >= svd_workers:
+                    pending.pop(0).result()
+            for future in pending:
+                future.result()
+        return factors
+
+    def train_model(self, graph, *, power_mode='dense', prune_tol=0., factorization_cache=None, cache_dim=None,
+                    **kwargs):
+        cache = FactorizationCache(factorization_cache, graph, 'grarep', silent=self.silent, kstep=self.kstep,
+                                   power_mode=power_mode, prune_tol=prune_tol, **svd_options(kwargs))
+        RepMat = torch.zeros((graph.nodesize, int(self.dim * self.kstep)))
+
+        def write_step(i, U, S):  # each step fills its own columns as soon as it is factorized
+            Rk = self.GetRepUseSVD(U, S, 0.5)
+            RepMat[:, self.dim*i:self.dim*(i+1)] = torch.nn.functional.normalize(Rk, p=2, dim=1)
+
+        computed = False
+
+        def compute(rank):
+            nonlocal computed
+            computed = True
+            # without a cache directory the factors are not needed once their columns are written
+            return self.factorize(graph, rank, power_mode, prune_tol=prune_tol, on_step=write_step,
+                                  keep=cache.path is not None, **kwargs)
+
+        factors = cache.get(self.dim, compute, cache_dim // self.kstep if cache_dim else None)
+        if not computed:  # served from the cache
+            for i, (U, S) in enumerate(factors):
+                write_step(i, U, S)
         return RepMat
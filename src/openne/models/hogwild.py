@@ -0,0 +1,94 @@
+import queue
+import torch
+import torch.multiprocessing as mp
+
+
+def _run(target, rank, args, results):
+    results.put((rank, target(rank, *args)))
+
+
+def hogwild(target, workers, *args):
+    """
+        Run target(rank, *args) in `workers` processes and return their results ordered by rank.
+        Tensors to be updated lock-free must be placed in shared memory beforehand
+        (module.share_memory() or tensor.share_memory_()).
+        With workers <= 1 target runs in the current process.
+    """
+    if workers <= 1:
+        return [target(0, *args)]
+    results = mp.Queue()
+    processes = []
+    for rank in range(workers):
+        p = mp.Process(target=_run, args=(target, rank, args, results))
+        p.start()
+        processes.append(p)
+    ret = []
+    while len(ret) < workers:  # drain before join, otherwise large results may deadlock
+        try:
+            ret.append(results.get(timeout=1))
+        except queue.Empty:
+            for p in processes:
+                if p.exitcode not in (None, 0):
+                    for q in processes:
+                        q.terminate()
+                    raise RuntimeError("Hogwild worker (PID {}) exited with code {}.".format(p.pid, p.exitcode))
+    for p in processes:
+        p.join()
+    return [r for _, r in sorted(ret, key=lambda x: x[0])]
+
+
+def worker_threads(workers):
+    """ Number of intra-op threads each of `workers` processes should use. """
+    return max(1, torch.get_num_threads() // max(1, workers))
+
+
+def _serve(obj, rank, threads, seed, commands, results):
+    torch.set_num_threads(threads)
+    if seed is not None:  # forked workers would otherwise share the parent's random stream
+        torch.manual_seed(seed)
+    while True:
+        cmd = commands.get()
+        if cmd is None:
+            break
+        name, args, kwargs = cmd
+        try:
+            results.put((True, getattr(obj, name)(rank, *args, **kwargs)))
+        except Exception as e:
+            results.put((False, "{}: {}".format(type(e).__name__, e)))
+
+
+class HogwildWorker:
+    """
+        A persistent process holding a (forked) copy of obj, on which obj.<name>(rank, *args) is
+        called on request. Tensors of obj in shared memory are updated lock-free and seen by every
+        process; everything else (e.g. optimizer moments, samplers) is private to the worker and
+        persists between calls, unlike with hogwild().
+    """
+    def __init__(self, obj, rank=0, threads=1, seed=None):
+        self.rank = rank
+        self.commands = mp.Queue()
+        self.results = mp.Queue()
+        self.process = mp.Process(target=_serve, args=(obj, rank, threads, seed, self.commands, self.results),
+                                  daemon=True)
+        self.process.start()
+
+    def call(self, name, *args, **kwargs):
+        self.commands.put((name, args, kwargs))
+
+    def result(self):
+        while True:
+            try:
+                ok, ret = self.results.get(timeout=1)
+                break
+            except queue.Empty:
+                if not self.process.is_alive():
+                    raise RuntimeError("Hogwild worker (PID {}) exited with code {}.".format(
+                        self.process.pid, self.process.exitcode))
+        if not ok:
+            raise RuntimeError("Hogwild worker {} failed: {}".format(self.rank, ret))
+        return ret
+
+    def close(self):
+        if self.process.is_alive():
+            self.commands.put(None)
+            self.process.join()
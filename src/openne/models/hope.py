@@ -1,13 +1,120 @@
+import numpy as np
+import scipy.sparse as sp
 import scipy.sparse.linalg as sla
 import scipy.linalg as la
 from sklearn.preprocessing import normalize
 
 from .models import *
+from .factorization import svds, svd_options, check_svd_parameters, check_cache_parameters, FactorizationCache
+from .components import connected_blocks, solve_components, select_columns, use_dense
 
 __author__ = "Alan WANG"
 __email__ = "alan1995wang@outlook.com"
 
 
+def _neumann(step, x, tol, max_terms, first=1):
+    """
+        sum_{k >= first} step^k(x), stopping once a term is below tol relative to the sum.
+    """
+    term = np.asarray(x, dtype=np.float64)
+    for _ in range(first):
+        term = step(term)
+    total = term.copy()
+    for _ in range(max_terms):
+        term = step(term)
+        total += term
+        term_norm = la.norm(term)
+        if not np.isfinite(term_norm):
+            break
+        if term_norm <= tol * la.norm(total):
+            return total
+    raise ValueError("Neumann series did not converge in {} terms; the spectral radius of the series "
+                     "matrix is probably >= 1. Use a smaller beta/alpha or proximity_solver='lu'.".format(max_terms))
+
+
+def spectral_radius(A, iters=30):
+    """
+        Estimate of the spectral radius of a nonnegative sparse matrix A by power iteration on A + I,
+        whose dominant eigenvalue is rho(A) + 1 (the shift avoids oscillation on periodic graphs).
+    """
+    x = np.ones(A.shape[0])
+    rho = 0.
+    for _ in range(iters):
+        y = A @ x + x
+        norm = la.norm(y)
+        if norm == 0:
+            return 0.
+        rho = norm / la.norm(x) - 1
+        x = y / norm
+    return rho
+
+
+def proximity_operator(A, measurement='katz', beta=0.02, alpha=0.5, solver='neumann', tol=1e-6, max_terms=1000,
+                       debug=None):
+    """
+        The HOPE proximity matrix S = M_g^-1 * M_l of adjacency A (scipy sparse) as a LinearOperator.
+        S is never formed: products with S and S^T take sparse matvecs plus, for katz and rpr,
+        either a truncated Neumann series (solver='neumann') or solves with a sparse LU factor of M_g
+        (solver='lu', exact but subject to fill-in).
+        The katz series only converges for beta * rho(A) < 1, which is checked up front; otherwise
+        the LU solver is used instead. (The rpr series always converges, as rho(P) <= 1 and alpha < 1.)
+    """
+    n = A.shape[0]
+    A = sp.csr_matrix(A, dtype=np.float64)
+    At = A.T.tocsr()
+    if measurement == 'katz' and solver == 'neumann':
+        rho = spectral_radius(A)
+        if beta * rho >= 0.99:  # also keeps the series from needing thousands of terms near the bound
+            if debug is not None:
+                debug("katz: beta * rho(A) = {:.3g} * {:.3g} >= 1, the Neumann series diverges; "
+                      "using proximity_solver='lu'".format(beta, rho))
+            solver = 'lu'
+    if measurement == 'katz':  # (I - beta * A)^-1 - I = (I - beta * A)^-1 * beta * A
+        if solver == 'lu':
+            lu = sla.splu((sp.identity(n, format='csc') - beta * A).tocsc())
+            matvec = lambda x: lu.solve(beta * (A @ x))
+            rmatvec = lambda x: beta * (At @ lu.solve(np.asarray(x, dtype=np.float64), trans='T'))
+        else:
+            matvec = lambda x: _neumann(lambda y: beta * (A @ y), x, tol, max_terms)
+            rmatvec = lambda x: _neumann(lambda y: beta * (At @ y), x, tol, max_terms)
+    elif measurement == 'cn':  # Common Neighbors: A^2
+        matvec = lambda x: A @ (A @ x)
+        rmatvec = lambda x: At @ (At @ x)
+    elif measurement == 'rpr':  # Rooted PageRank: (1 - alpha)(I - alpha * P)^-1, P row-normalized
+        degree = np.asarray(A.sum(1)).ravel()
+        P = sp.diags(np.divide(1., degree, out=np.zeros(n), where=degree > 0)) @ A
+        Pt = P.T.tocsr()
+        if solver == 'lu':
+            lu = sla.splu((sp.identity(n, format='csc') - alpha * P).tocsc())
+            matvec = lambda x: (1 - alpha) * lu.solve(np.asarray(x, dtype=np.float64))
+            rmatvec = lambda x: (1 - alpha) * lu.solve(np.asarray(x, dtype=np.float64), trans='T')
+        else:
+            matvec = lambda x: (1 - alpha) * _neumann(lambda y: alpha * (P @ y), x, tol, max_terms, first=0)
+            rmatvec = lambda x: (1 - alpha) * _neumann(lambda y: alpha * (Pt @ y), x, tol, max_terms, first=0)
+    else:  # Adamic-Adar: A * D * A, D = diag(1 / (in-degree + out-degree))
+        degree = np.asarray(A.sum(0)).ravel() + np.asarray(A.sum(1)).ravel()
+        D = sp.diags(np.divide(1., degree, out=np.zeros(n), where=degree > 0))
+        matvec = lambda x: A @ (D @ (A @ x))
+        rmatvec = lambda x: At @ (D @ (At @ x))
+    return sla.LinearOperator((n, n), matvec=matvec, rmatvec=rmatvec, matmat=matvec, rmatmat=rmatvec,
+                              dtype=np.float64)
+
+
+def hope_component(A, k, measurement, beta, alpha, proximity_solver, tol, max_terms, svd_kwargs):
+    """
+        The k largest singular triplets of the proximity matrix of one connected component, as
+        (s, [u, v]); the proximity of every measurement is zero between components.
+    """
+    m = A.shape[0]
+    S = proximity_operator(A, measurement, beta=beta, alpha=alpha, solver=proximity_solver, tol=tol,
+                           max_terms=max_terms)
+    if use_dense(m, k):
+        u, s, vt = np.linalg.svd(S.matmat(np.eye(m)))
+        return s[:k], [u[:, :k], vt[:k].T]
+    u, s, vt = svds(S, k=min(k, m - 1), **svd_kwargs)
+    return s, [u, vt.T]
+
+
 class HOPE(ModelWithEmbeddings):
     def __init__(self, dim, **kwargs):
         """
@@ -22,37 +129,40 @@ class HOPE(ModelWithEmbeddings):
         if 'measurement' not in kwargs:
             check_existance(kwargs, {'beta': 0.02})
             check_existance(kwargs, {'alpha': 0.5})
-        check_existance(kwargs, {'measurement': 'katz'})
-        check_range(kwargs, {'measurement': ['katz', 'cn', 'rpr', 'aa']})
+        check_existance(kwargs, {'measurement': 'katz',
+                                 'proximity_solver': 'neumann',
+                                 'series_tol': 1e-6,
+                                 'series_max_terms': 1000,
+                                 'per_component': False,
+                                 'component_workers': 4})
+        check_range(kwargs, {'measurement': ['katz', 'cn', 'rpr', 'aa'],
+                             'proximity_solver': ['neumann', 'lu'],
+                             'series_tol': 'positive',
+                             'series_max_terms': 'positive',
+                             'per_component': [True, False, 0, 1],
+                             'component_workers': 'positive'})
+        check_svd_parameters(kwargs)
+        check_cache_parameters(kwargs)
         if kwargs['measurement'] == 'katz':
             check_existance(kwargs, {'beta': 0.02})
         if kwargs['measurement'] == 'rpr':
             check_existance(kwargs, {'alpha': 0.5})
         return kwargs
 
-    def train_model(self, graph, *, measurement='katz', **kwargs):
-        n = graph.nodesize
-        A = graph.adjmat(directed=True, weighted=False)  # brute force...
-        if measurement == 'katz':  # Katz: M_g^-1 * M_l = (I - beta * A)^-1 - I
-            S = (la.inv(np.identity(n) - kwargs['beta'] * A) - np.identity(n))
-
-            # M_g = np.eye(n) - kwargs['beta'] * A
-            # M_l = kwargs['beta'] * A
-        elif measurement == 'cn':  # Common Neighbors: S = A^2
-            S = np.matmul(A, A)
-            # M_g = I
-            # M_l = A^2
-        elif measurement == 'rpr':  # Rooted PageRank: (1 - alpha)(I - alpha * P)^-1
-            P = graph.adjmat(directed=True, weighted=False, scaled=1)  # scaled=0 in paper but possibly wrong?
-            S = (1 - kwargs['alpha']) * la.inv(np.eye(n) - kwargs['alpha'] * P)
-        else: # Adamic-Adar: Mg^-1 * M_l
-            D = np.eye(n)
-            for i in range(n):
-                k = sum(A[i][j] + A[j][i] for j in range(n))
-                D[i][i] /= k
-            S = np.matmul(np.matmul(A, D), A)
-
-        u, s, vt = sla.svds(S, k=self.dim // 2)  # this one directly use the d/2-dim core for svd
+    def train_model(self, graph, *, measurement='katz', proximity_solver='neumann', series_tol=1e-6,
+                    series_max_terms=1000, per_component=False, component_workers=4, factorization_cache=None,
+                    cache_dim=None, **kwargs):
+        beta, alpha = kwargs.get('beta', 0.02), kwargs.get('alpha', 0.5)
+        cache = FactorizationCache(factorization_cache, graph, 'hope', silent=self.silent, measurement=measurement,
+                                   beta=beta, alpha=alpha, proximity_solver=proximity_solver, series_tol=series_tol,
+                                   series_max_terms=series_max_terms, per_component=bool(per_component),
+                                   **svd_options(kwargs))
+        u, s, vt = cache.get(self.dim // 2, lambda k: self.factorize(
+            graph, k, measurement, beta, alpha, proximity_solver, series_tol, series_max_terms, per_component,
+            component_workers, **kwargs), cache_dim // 2 if cache_dim else None)
+        # singular values are ascending: the top dim/2 triplets are the last ones
+        k = self.dim // 2
+        u, s, vt = u[:, -k:], s[-k:], vt[-k:]
 
         sigma = np.sqrt(s)
         X1 = normalize(u * sigma)
@@ -64,3 +174,23 @@ class HOPE(ModelWithEmbeddings):
         # X2 = normalize(np.matmul(vt.T, sigma))
 
         return torch.cat((torch.tensor(X1), torch.tensor(X2)), dim=1)
+
+    def factorize(self, graph, k, measurement, beta, alpha, proximity_solver, series_tol, series_max_terms,
+                  per_component, component_workers, **kwargs):
+        """ the k largest singular triplets u, s, vt of the proximity matrix, s ascending """
+        A = graph.adjmat(directed=True, weighted=False, sparse=True)
+        if per_component:
+            # the proximity matrix is block-diagonal over the connected components: its top singular
+            # triplets are the top ones among those of the components
+            blocks = connected_blocks(A)
+            results = solve_components(hope_component, A, blocks, k,
+                                       (measurement, beta, alpha, proximity_solver, series_tol, series_max_terms,
+                                        svd_options(kwargs)), component_workers)
+            u, v = select_columns(blocks, results, graph.nodesize, k, largest=True)
+            s = np.array(sorted(value for values, _ in results for value in values)[-k:])
+            return u, s, v.T
+        S = proximity_operator(A, measurement, beta=beta, alpha=alpha, solver=proximity_solver, tol=series_tol,
+                               max_terms=series_max_terms, debug=self.debug)
+
+        # this one directly use the d/2-dim core for svd
+        return svds(S, k=k, debug=self.debug, **svd_options(kwargs))
@@ -1,6 +1,12 @@
+from time import time
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.csgraph import connected_components
 import torch
 from ..utils import *
 from .models import *
+from .factorization import smallest_eigenpairs, check_cache_parameters, FactorizationCache
+from .components import connected_blocks, solve_components, select_columns, use_dense
 
 __author__ = "Wang Binlu"
 __email__ = "wblmail@whu.edu.cn"
@@ -15,17 +21,65 @@ def getLap(adj_mat):
     return norm_lap_mat
 
 
+def getSparseLap(adj):
+    """
+        Sparse D^-1/2 (D - A) D^-1/2 = I - D^-1/2 A D^-1/2 of a scipy sparse adjacency, symmetrized;
+        rows and columns of isolated nodes are zero.
+    """
+    adj = sp.csr_matrix(adj, dtype=np.float64)
+    degree = np.asarray(adj.sum(1)).ravel()
+    deg_trans = sp.diags(np.divide(1., np.sqrt(degree), out=np.zeros_like(degree), where=degree > 0))
+    L = sp.diags((degree > 0).astype(np.float64)) - deg_trans @ adj @ deg_trans
+    return ((L + L.T) / 2).tocsr()
+
+
+def lap_component(adj, k, eigen_solver, eigen_tol):
+    """
+        The k smallest nonzero eigenpairs of the normalized Laplacian of one connected component
+        (its single zero eigenvalue dropped).
+    """
+    L = getSparseLap(adj)
+    if eigen_solver == 'dense' or use_dense(L.shape[0], k):
+        w, vec = np.linalg.eigh(L.toarray())
+        keep = w > 1e-10
+        return w[keep][:k], [vec[:, keep][:, :k]]
+    w, vec = smallest_eigenpairs(L, k + 1, eigen_solver, eigen_tol)
+    return w[1:], [vec[:, 1:]]
+
+
 class LaplacianEigenmaps(ModelWithEmbeddings):
     def __init__(self, dim=128, **kwargs):
         super(LaplacianEigenmaps, self).__init__(dim=dim, **kwargs)
     othername = 'lap'
     @classmethod
     def check_train_parameters(cls, **kwargs):
-        check_existance(kwargs, {'dim': 128})
-        check_range(kwargs, {'dim': 'positive'})
+        check_existance(kwargs, {'dim': 128,
+                                 'eigen_solver': 'lanczos',
+                                 'eigen_tol': 1e-8,
+                                 'per_component': False,
+                                 'component_workers': 4})
+        check_range(kwargs, {'dim': 'positive',
+                             'eigen_solver': ['dense', 'lanczos', 'shift_invert', 'lobpcg'],
+                             'eigen_tol': (0, 1),
+                             'per_component': [True, False, 0, 1],
+                             'component_workers': 'positive'})
+        check_cache_parameters(kwargs)
         return kwargs
 
-    def train_model(self, graph, **kwargs):
+    def train_model(self, graph, *, eigen_solver='lanczos', eigen_tol=1e-8, per_component=False,
+                    component_workers=4, factorization_cache=None, cache_dim=None, **kwargs):
+        # eigenvectors in ascending order of eigenvalue: those of a smaller dim are the first columns
+        cache = FactorizationCache(factorization_cache, graph, 'lap', silent=self.silent, eigen_solver=eigen_solver,
+                                   eigen_tol=eigen_tol, per_component=bool(per_component))
+        vec = cache.get(self.dim, lambda dim: self.factorize(graph, dim, eigen_solver, eigen_tol, per_component,
+                                                             component_workers), cache_dim)
+        return vec[:, :self.dim]
+
+    def factorize(self, graph, dim, eigen_solver, eigen_tol, per_component, component_workers):
+        if per_component:
+            return self.train_components(graph, dim, eigen_solver, eigen_tol, component_workers)
+        if eigen_solver != 'dense':
+            return self.train_sparse(graph, dim, eigen_solver, eigen_tol)
         adj_mat = torch.from_numpy(graph.adjmat(directed=True, weighted=False))
         lap_mat = getLap(adj_mat)
         w, vec = torch.symeig(lap_mat, eigenvectors=True)
@@ -34,5 +88,39 @@ class LaplacianEigenmaps(ModelWithEmbeddings):
             if w[i] > 1e-10:
                 start = i
                 break
-        vec = vec[:, start:start+self.dim]
+        vec = vec[:, start:start+dim]
         return vec
+
+    def train_sparse(self, graph, dim, eigen_solver, eigen_tol):
+        """
+            The multiplicity of eigenvalue 0 equals the number of connected components (isolated nodes
+            included), so exactly dim + #components eigenpairs are computed and the first #components dropped.
+        """
+        t0 = time()
+        adj = graph.adjmat(directed=True, weighted=False, sparse=True)
+        L = getSparseLap(adj)
+        n_zero = connected_components(L, directed=False)[0]
+        k = dim + n_zero
+        if k >= graph.nodesize:
+            raise ValueError("dim + number of connected components ({}) must be smaller than the number of "
+                             "nodes ({}) for eigen_solver={}; use eigen_solver='dense'.".format(
+                                 k, graph.nodesize, eigen_solver))
+        w, vec = smallest_eigenpairs(L, k, eigen_solver, eigen_tol)
+        self.debug("{} eigensolver: {} eigenpairs in {:.2f}s, {} zero eigenvalues dropped, "
+                   "max residual {:.2e}".format(eigen_solver, k, time() - t0, n_zero,
+                                               np.abs(L @ vec - vec * w).max()))
+        return torch.from_numpy(vec[:, n_zero:])
+
+    def train_components(self, graph, dim, eigen_solver, eigen_tol, workers):
+        """
+            Solves each connected component on its own (the large ones in parallel processes) and keeps
+            the dim smallest nonzero eigenvalues over all of them, which equals the solve on the whole graph.
+        """
+        t0 = time()
+        adj = graph.adjmat(directed=True, weighted=False, sparse=True)
+        blocks = connected_blocks(adj)
+        results = solve_components(lap_component, adj, blocks, dim, (eigen_solver, eigen_tol), workers)
+        vec, = select_columns(blocks, results, graph.nodesize, dim)
+        self.debug("{} components (largest {} nodes) solved in {:.2f}s".format(
+            len(blocks), len(blocks[0]), time() - t0))
+        return torch.from_numpy(vec)
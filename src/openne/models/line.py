@@ -9,11 +9,14 @@ from ..utils import *
 import torch.nn as nn
 import torch.nn.functional as F
 from .models import *
+from .sampling import degree_sampler
+from .hogwild import HogwildWorker, worker_threads
+from .prefetch import BatchPrefetcher
 
 class _LINE(ModelWithEmbeddings):
-    def __init__(self, dim=128, order=2, table_size=1e8, **kwargs):
+    def __init__(self, dim=128, order=2, **kwargs):
         kwargs['save'] = False
-        super(_LINE, self).__init__(dim=dim, order=order, table_size=table_size, **kwargs)
+        super(_LINE, self).__init__(dim=dim, order=order, **kwargs)
         self.cur_epoch = 0
         if order == 1:
             self.loss = self.first_loss
@@ -24,23 +27,25 @@ class _LINE(ModelWithEmbeddings):
     def check_train_parameters(cls, **kwargs):
         check_existance(kwargs, {'dim': 128,
                                  'order': 2,
-                                 'table_size': 1e8,
                                  'lr': 0.001,
                                  'batch_size': 1024,
                                  'negative_ratio': 5,
+                                 'prefetch_workers': 1,
+                                 'prefetch_depth': 16,
                                  'data_parallel': False})
         check_range(kwargs, {'dim': 'positive',
                              'order': 'positive',
-                             'table_size': 'positive',
                              'lr': 'positive',
                              'batch_size': 'positive',
-                             'negative_ratio': 'positive'})
+                             'negative_ratio': 'positive',
+                             'prefetch_workers': (0, np.inf),
+                             'prefetch_depth': (1, np.inf)})
 
     def first_loss(self, s, h, t):
-        return -(F.logsigmoid(s * (self._embeddings[h] * self._embeddings[t]).sum(dim=1))).mean()
+        return -(F.logsigmoid(s * (self.node_embeddings(h) * self.node_embeddings(t)).sum(dim=1))).mean()
 
     def second_loss(self, s, h, t):
-        return -(F.logsigmoid(s*(self._embeddings[h]*self.context_embeddings[t]).sum(dim=1))).mean()
+        return -(F.logsigmoid(s*(self.node_embeddings(h)*self.context_embeddings(t)).sum(dim=1))).mean()
 
     def copy(self, exceptions):
         ret = copy.deepcopy(self)
@@ -48,96 +53,79 @@ class _LINE(ModelWithEmbeddings):
             ret.__dict__.__setitem__(i, exceptions[i])
         return ret
 
-    def build(self, graph, *, lr=0.001, batch_size=1024, negative_ratio=5, **kwargs):
+    def build(self, graph, *, lr=0.001, batch_size=1024, negative_ratio=5, prefetch_workers=1, prefetch_depth=16,
+              **kwargs):
         cur_seed = random.getrandbits(32)
         torch.manual_seed(cur_seed)
         self.node_size = graph.nodesize
-        self._embeddings = nn.Parameter(nn.init.xavier_normal_(torch.zeros(self.node_size, self.dim)),
-                                        requires_grad=True)
-        self.context_embeddings = nn.Parameter(nn.init.xavier_normal_(torch.zeros(self.node_size, self.dim)),
-                                               requires_grad=True)
-        self.optimizer = torch.optim.Adam([self._embeddings, self.context_embeddings], lr=lr)
+        # sparse lookups + SparseAdam: a step only updates (and keeps moments for) the rows in the batch
+        self.node_embeddings = nn.Embedding(self.node_size, self.dim, sparse=True)
+        self.context_embeddings = nn.Embedding(self.node_size, self.dim, sparse=True)
+        nn.init.xavier_normal_(self.node_embeddings.weight)
+        nn.init.xavier_normal_(self.context_embeddings.weight)
+        self.optimizer = torch.optim.SparseAdam(list(self.node_embeddings.parameters()) +
+                                                list(self.context_embeddings.parameters()), lr=lr)
         look_up = graph.look_up_dict
-        self.edges = [(look_up[x[0]], look_up[x[1]]) for x in graph.G.edges()]
+        self.edges = torch.tensor([(look_up[x[0]], look_up[x[1]]) for x in graph.G.edges()],
+                                  dtype=torch.long).view(-1, 2)
         self.batch_size = batch_size
         self.negative_ratio = negative_ratio
+        self.prefetch_workers = prefetch_workers
+        self.prefetch_depth = prefetch_depth
         self.gen_sampling_table(graph)
 
     def train_model(self, graph, **kwargs):
+        self.debug_info, self.stall = self.run_epoch(0, graph.edgesize)
+
+    def run_epoch(self, rank, data_size, workers=1, seed=None):
+        """
+            One epoch over data_size edge draws, or this worker's shard of them when `workers` Hogwild
+            processes train the same embeddings (see LINE.after_build): every worker draws the same
+            permutation from `seed` and takes its entries rank, rank + workers, ...
+            Batches are sampled by background threads (see BatchPrefetcher).
+            Returns the sum of loss and the seconds spent waiting for batches.
+        """
         sum_loss = 0.0
-        batches = self.batch_iter(graph.edgesize)
-        batch_id = 0
+        if seed is None:
+            perm = torch.randperm(data_size)
+        else:
+            perm = torch.randperm(data_size, generator=torch.Generator().manual_seed(seed))
+        chunks = perm[rank::workers].split(self.batch_size)
+        batches = BatchPrefetcher(lambda r, n: self.batch_iter(chunks[r::n]),
+                                  self.prefetch_workers, self.prefetch_depth)
         for batch in batches:
             h, t, sign = batch
             self.optimizer.zero_grad()
             cur_loss = self.loss(sign, h, t)
-            sum_loss += cur_loss
+            sum_loss += cur_loss.detach()
             cur_loss.backward()
             self.optimizer.step()
-            batch_id += 1
-        self.debug_info = sum_loss
+        return float(sum_loss), batches.stall
 
     def _get_embeddings(self, graph, **kwargs):
-        self.embeddings = self._embeddings.detach()
-
-    def batch_iter(self, data_size):
-        table_size = self.table_size
-        shuffle_indices = torch.randperm(data_size).tolist()
-        mod = 0
-        mod_size = 1 + self.negative_ratio
-        h = []
-        t = []
-        sign = 0
-
-        start_index = 0
-        end_index = min(start_index+self.batch_size, data_size)
-        while start_index < data_size:
-            if mod == 0:
-                sign = 1.
-                h = []
-                t = []
-                for i in range(start_index, end_index):
-                    if not random.random() < self.edge_prob[shuffle_indices[i]]:
-                        shuffle_indices[i] = self.edge_alias[shuffle_indices[i]]
-                    cur_h = self.edges[shuffle_indices[i]][0]
-                    cur_t = self.edges[shuffle_indices[i]][1]
-                    h.append(cur_h)
-                    t.append(cur_t)
-            else:
-                sign = -1.
-                t = []
-                for i in range(len(h)):
-                    t.append(self.sampling_table[random.randint(0, table_size-1)])
-            sign = torch.tensor([sign], device=self._device)
-            yield h, t, sign
-            mod += 1
-            mod %= mod_size
-            if mod == 0:
-                start_index = end_index
-                end_index = min(start_index+self.batch_size, data_size)
+        self.embeddings = self.node_embeddings.weight.detach()
 
-    def gen_sampling_table(self, graph):
-        table_size = int(self.table_size)
-        power = 0.75
-        numNodes = self.node_size
+    def batch_iter(self, chunks):
+        """
+            For each chunk of alias columns, yields the positive batch (sign 1) followed by
+            negative_ratio batches with the same heads and sampled tails (sign -1).
+            Alias acceptance, edge selection and all negatives of a batch are drawn in single tensor ops.
+        """
+        pos_sign = torch.tensor([1.], device=self._device)
+        neg_sign = torch.tensor([-1.], device=self._device)
+        for index in chunks:
+            rejected = torch.rand(len(index)) >= self.edge_prob[index]
+            index = torch.where(rejected, self.edge_alias[index], index)
+            h = self.edges[index, 0].to(self._device)
+            yield h, self.edges[index, 1].to(self._device), pos_sign
+            negatives = self.negative_sampler.sample(self.negative_ratio, len(index)).to(self._device)
+            for t in negatives:
+                yield h, t, neg_sign
 
+    def gen_sampling_table(self, graph):
         self.debug("Pre-processing for non-uniform negative sampling!")
-        node_degree = torch.zeros(numNodes)  # out degree
-        look_up = graph.look_up_dict
-        for edge in graph.G.edges():
-            node_degree[look_up[edge[0]]] += graph.G[edge[0]][edge[1]]["weight"]
-
-        norm = float((node_degree**power).sum())  # float is faster than tensor when visited
-        node_degree = node_degree.tolist()        # list has fastest visit speed
-        # torch is much slower when referring to frequent visits
-        self.sampling_table = np.zeros(table_size, dtype=np.int32)
-        p = 0
-        i = 0
-        for j in range(numNodes):
-            p += math.pow(node_degree[j], power) / norm
-            while i < table_size and i / table_size < p:
-                self.sampling_table[i] = j
-                i += 1
+        # negatives are drawn with probability proportional to (weighted out-degree) ** 0.75
+        self.negative_sampler = degree_sampler(graph, power=0.75)
 
         data_size = graph.G.number_of_edges()
         self.edge_alias = [0 for i in range(data_size)]
@@ -180,6 +168,8 @@ class _LINE(ModelWithEmbeddings):
         while num_small_block:
             num_small_block -= 1
             self.edge_prob[small_block[num_small_block]] = 1
+        self.edge_alias = torch.tensor(self.edge_alias, dtype=torch.long)
+        self.edge_prob = torch.tensor(self.edge_prob, dtype=torch.float32)
 
 class LINE(ModelWithEmbeddings):
     def __init__(self, dim=128, order=3, **kwargs):
@@ -194,18 +184,23 @@ class LINE(ModelWithEmbeddings):
     @classmethod
     def check_train_parameters(cls, **kwargs):
         check_existance(kwargs, {'dim': 128,
-                                 'table_size': 1e8,
                                  'lr': 0.001,
                                  'batch_size': 1024,
                                  'negative_ratio': 5,
                                  'epochs': 40,
+                                 'concurrent_orders': False,
+                                 'workers': 1,
+                                 'prefetch_workers': 1,
+                                 'prefetch_depth': 16,
                                  'data_parallel': False})
         check_range(kwargs, {'dim': 'positive',
                              'order': 'positive',
-                             'table_size': 'positive',
                              'lr': 'positive',
                              'batch_size': 'positive',
                              'negative_ratio': 'positive',
+                             'workers': 'positive',
+                             'prefetch_workers': (0, np.inf),
+                             'prefetch_depth': (1, np.inf),
                              'epochs': 'positive'})
         return kwargs
 
@@ -220,15 +215,53 @@ class LINE(ModelWithEmbeddings):
     def after_build(self, graph, **kwargs):
         if self.order == 3 and kwargs.get('data_parallel', False) and len(kwargs.get('_device', [])) >= 2:
             self.model2.to(kwargs['_device'][1])
+        self._workers = []
+        self._concurrent = self.order == 3 and kwargs.get('concurrent_orders', False)
+        workers = kwargs.get('workers', 1)
+        if kwargs.get('_device', torch.device('cpu')).type == 'cpu' and (workers > 1 or self._concurrent):
+            # Hogwild: embeddings in shared memory, each worker process runs its own sampler and
+            # optimizer and updates them lock-free. Halves of order=3 share no parameters, so with
+            # concurrent_orders both groups of workers train at the same time.
+            models = self._models()
+            threads = worker_threads(workers * (len(models) if self._concurrent else 1))
+            for model in models:
+                model.share_memory()
+                self._workers.append((model, [HogwildWorker(model, rank, threads, random.getrandbits(32))
+                                              for rank in range(workers)]))
 
-    def train_model(self, graph, **kwargs):
+    def _models(self):
         if self.order == 3:
-            self.model1.train_model(graph, **kwargs)
-            self.model2.train_model(graph, **kwargs)
-            self.debug_info = "sum of loss: {!s}".format(self.model1.debug_info + self.model2.debug_info)
+            return [self.model1, self.model2]
+        return [self.model]
+
+    def _run_workers(self, groups, data_size):
+        for _, group in groups:
+            seed = random.getrandbits(32)  # one permutation of the edge draws per epoch, sharded by rank
+            for worker in group:
+                worker.call('run_epoch', data_size, len(group), seed)
+        for model, group in groups:  # loss is aggregated once per epoch
+            results = [worker.result() for worker in group]
+            model.debug_info = sum(loss for loss, _ in results)
+            model.stall = sum(stall for _, stall in results)
+
+    def teardown(self, graph, **kwargs):
+        for _, group in self._workers:
+            for worker in group:
+                worker.close()
+        self._workers = []
+
+    def train_model(self, graph, **kwargs):
+        if self._workers:
+            if self._concurrent:
+                self._run_workers(self._workers, graph.edgesize)
+            else:
+                for group in self._workers:
+                    self._run_workers([group], graph.edgesize)
         else:
-            self.model.train_model(graph, **kwargs)
-            self.debug_info = "sum of loss: {!s}".format(self.model.debug_info)
+            for model in self._models():
+                model.train_model(graph, **kwargs)
+        self.debug_info = "sum of loss: {!s}, sampling stall: {:.2f}s".format(
+            sum(model.debug_info for model in self._models()), sum(model.stall for model in self._models()))
 
     def _get_embeddings(self, graph, **kwargs):
         if self.order == 3:
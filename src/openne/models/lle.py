@@ -7,12 +7,33 @@ import scipy.sparse as sp
 import scipy.sparse.linalg as lg
 from ..utils import *
 from .models import *
+from .factorization import svds, svd_options, check_svd_parameters, smallest_eigenpairs, \
+    check_cache_parameters, FactorizationCache
 from sklearn.preprocessing import normalize
+from .components import connected_blocks, solve_components, select_columns, use_dense
 
 __author__ = "Alan WANG"
 __email__ = "alan1995wang@outlook.com"
 
 
+def lle_component(A, k, eigen_solver, eigen_tol, svd_kwargs):
+    """
+        The k smallest singular values of I - A on one connected component and their right singular
+        vectors, without the null vector (constant on the component) of a row-stochastic A.
+    """
+    n = A.shape[0]
+    I_min_A = sp.eye(n) - A
+    if use_dense(n, k):
+        w, vec = np.linalg.eigh((I_min_A.T @ I_min_A).toarray())
+        keep = w > 1e-10
+        return np.sqrt(w[keep][:k]), [vec[:, keep][:, :k]]
+    if eigen_solver == 'svds':
+        u, s, vt = svds(I_min_A, k=k + 1, which='SM', **svd_kwargs)
+        return s[1:], [vt[1:].T]
+    w, vec = smallest_eigenpairs(sp.csr_matrix(I_min_A.T @ I_min_A, dtype=np.float64), k + 1, eigen_solver, eigen_tol)
+    return np.sqrt(np.clip(w[1:], 0, None)), [vec[:, 1:]]
+
+
 class LLE(ModelWithEmbeddings):
 
     def __init__(self, dim, **kwargs):
@@ -26,18 +47,85 @@ class LLE(ModelWithEmbeddings):
 
     @classmethod
     def check_train_parameters(cls, **kwargs):
-        check_existance(kwargs, {'dim': 128, 'sparse': False})
-        check_range(kwargs, {'dim': 'positive', 'sparse': [1, 0, True, False]})
+        check_existance(kwargs, {'dim': 128, 'sparse': True,
+                                 'eigen_solver': 'shift_invert',
+                                 'eigen_tol': 1e-8,
+                                 'per_component': False,
+                                 'component_workers': 4})
+        check_range(kwargs, {'dim': 'positive', 'sparse': [1, 0, True, False],
+                             'eigen_solver': ['svds', 'lanczos', 'shift_invert', 'lobpcg'],
+                             'eigen_tol': (0, 1),
+                             'per_component': [True, False, 0, 1],
+                             'component_workers': 'positive'})
+        check_svd_parameters(kwargs)
+        check_cache_parameters(kwargs)
         return kwargs
 
-    def train_model(self, graph, *, sparse=False, **kwargs):
+    def train_model(self, graph, *, sparse=True, eigen_solver='shift_invert', eigen_tol=1e-8, per_component=False,
+                    component_workers=4, factorization_cache=None, cache_dim=None, **kwargs):
+        # singular vectors in ascending order of singular value: those of a smaller dim are the first columns
+        cache = FactorizationCache(factorization_cache, graph, 'lle', silent=self.silent,
+                                   sparse=bool(sparse) or eigen_solver != 'svds', eigen_solver=eigen_solver,
+                                   eigen_tol=eigen_tol, per_component=bool(per_component),
+                                   **(svd_options(kwargs) if eigen_solver == 'svds' else {}))
+        vec = cache.get(self.dim, lambda dim: self.factorize(graph, dim, sparse, eigen_solver, eigen_tol,
+                                                             per_component, component_workers, **kwargs), cache_dim)
+        return vec[:, :self.dim]
+
+    def factorize(self, graph, dim, sparse, eigen_solver, eigen_tol, per_component, component_workers, **kwargs):
+        """
+            The bottom right singular vectors of I - A are the bottom eigenvectors of the sparse PSD
+            matrix (I - A)^T (I - A), which the eigensolvers of smallest_eigenpairs find far faster and more
+            reliably than svds(which='SM'). eigen_solver='svds' keeps the direct SVD (see --svd-solver);
+            only that path honours sparse=False. Diagnostics of the solve are kept in self.diagnostics.
+        """
+        t0 = time()
+        sparse = sparse or eigen_solver != 'svds'
         A = graph.adjmat(directed=False, weighted=True, sparse=sparse)
         normalize(A, norm='l1', axis=1, copy=False)
         if sparse:
             I_n = sp.eye(graph.nodesize)
         else:
             I_n = np.eye(graph.nodesize)
+        if per_component:
+            return self.train_components(graph, A, dim, eigen_solver, eigen_tol, component_workers, **kwargs)
         I_min_A = I_n - A
-        u, s, vt = lg.svds(I_min_A, k=self.dim + 1, which='SM')
-        vt = torch.tensor(vt)
-        return vt.t()[:, 1:]
\ No newline at end of file
+        if eigen_solver == 'svds':
+            u, s, vt = svds(I_min_A, k=dim + 1, which='SM', debug=self.debug, **svd_options(kwargs))
+            self.diagnostics = {'solver': eigen_solver, 'time': time() - t0, 'singular_values': s}
+            vt = torch.tensor(vt)
+            return vt.t()[:, 1:]
+        MtM = sp.csr_matrix(I_min_A.T @ I_min_A, dtype=np.float64)
+        try:
+            w, vec = smallest_eigenpairs(MtM, dim + 1, eigen_solver, eigen_tol)
+        except lg.ArpackNoConvergence as e:
+            raise RuntimeError("LLE: {} eigensolver did not converge after {:.2f}s ({} of {} eigenpairs); "
+                               "try another --eigen-solver or a larger --eigen-tol.".format(
+                                   eigen_solver, time() - t0, len(e.eigenvalues), dim + 1))
+        residual = np.linalg.norm(MtM @ vec - vec * w, axis=0)
+        self.diagnostics = {'solver': eigen_solver,
+                            'time': time() - t0,
+                            'singular_values': np.sqrt(np.clip(w, 0, None)),
+                            'max_residual': float(residual.max()),
+                            # eigsh / lobpcg stop at a residual of about tol * |lambda_max|
+                            'converged': bool(residual.max() <= 100 * max(eigen_tol, 1e-12) * max(1., w.max()))}
+        self.debug("LLE {} eigensolver: {:.2f}s, smallest singular value {:.2e}, max residual {:.2e}{}".format(
+            eigen_solver, self.diagnostics['time'], self.diagnostics['singular_values'][0],
+            self.diagnostics['max_residual'], '' if self.diagnostics['converged'] else ' (NOT converged)'))
+        return torch.from_numpy(vec[:, 1:])
+
+    def train_components(self, graph, A, dim, eigen_solver, eigen_tol, workers, **kwargs):
+        """
+            Solves each connected component on its own (the large ones in parallel processes) and keeps the
+            dim smallest singular values over all of them. Unlike the whole-graph solve, the null vector of
+            every component is dropped, not only one.
+        """
+        t0 = time()
+        blocks = connected_blocks(A)
+        results = solve_components(lle_component, A, blocks, dim,
+                                   (eigen_solver, eigen_tol, svd_options(kwargs)), workers)
+        vec, = select_columns(blocks, results, graph.nodesize, dim)
+        self.diagnostics = {'solver': eigen_solver, 'time': time() - t0, 'components': len(blocks)}
+        self.debug("LLE: {} components (largest {} nodes) solved in {:.2f}s".format(
+            len(blocks), len(blocks[0]), self.diagnostics['time']))
+        return torch.from_numpy(vec)
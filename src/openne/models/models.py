@@ -2,11 +2,33 @@ from typing import Any
 
 import torch
 import os
+import collections.abc
 from time import time
 from ..utils import *
 import inspect
 import numpy
 
+
+class EmbeddingVectors(collections.abc.Mapping):
+    """
+        Read-only {node: embedding} view over an embedding matrix ordered by look_back_list.
+        Rows are looked up on access, so no per-node dict is built.
+    """
+    def __init__(self, embeddings, look_back_list, look_up_dict):
+        self.embeddings = embeddings
+        self.look_back_list = look_back_list
+        self.look_up_dict = look_up_dict
+
+    def __getitem__(self, node):
+        return self.embeddings[self.look_up_dict[node]]
+
+    def __iter__(self):
+        return iter(self.look_back_list)
+
+    def __len__(self):
+        return len(self.look_back_list)
+
+
 class ModelWithEmbeddings(torch.nn.Module):
     def __init__(self, *, output=None, save=True, **kwargs):
         super(ModelWithEmbeddings, self).__init__()
@@ -102,6 +124,8 @@ class ModelWithEmbeddings(torch.nn.Module):
                                      'debug_output_interval': 5,
                                      '_multiple_epochs': _multiple_epochs,
                                      'output': None,
+                                     'inference_chunk_size': 4096,
+                                     'inference_output': None,
                                      'save': True,})
         if graphtype:
             if not torch.cuda.is_available() or new_kwargs['cpu']:
@@ -165,6 +189,44 @@ class ModelWithEmbeddings(torch.nn.Module):
             self.embeddings = self.train_model(graph, **kwargs)
 
 
+    def embedding_blocks(self, graph, chunk_size, **kwargs):
+        """
+            Yields the final embeddings in consecutive blocks of at most chunk_size nodes,
+            ordered by look_back_list.
+            Implement it when computing all embeddings at once takes much more memory than a block
+            (e.g. encoders run on adjacency rows); make_output() then uses it instead of _get_embeddings().
+        """
+        raise NotImplementedError
+
+    def _infer_embeddings(self, graph, *, inference_chunk_size=4096, inference_output=None, **kwargs):
+        """
+            Collects embedding_blocks() into a preallocated matrix, or into a .npy memmap at
+            inference_output, so peak memory is the output plus one block.
+        """
+        embeddings = None
+        array = None
+        start = 0
+        training = self.training
+        self.eval()
+        with torch.no_grad():
+            for block in self.embedding_blocks(graph, inference_chunk_size, **kwargs):
+                block = block.detach().to('cpu', torch.float32)
+                if embeddings is None:
+                    shape = (graph.nodesize, block.shape[1])
+                    if inference_output is not None:
+                        self.debug("Writing embeddings to {}...".format(inference_output))
+                        array = numpy.lib.format.open_memmap(inference_output, mode='w+',
+                                                             dtype=numpy.float32, shape=shape)
+                        embeddings = torch.from_numpy(array)
+                    else:
+                        embeddings = torch.empty(shape)
+                embeddings[start:start + len(block)] = block
+                start += len(block)
+        self.train(training)
+        if array is not None:
+            array.flush()
+        return embeddings
+
     def make_output(self, graph, **kwargs):
         """
             Generates self.embeddings and self.vectors.
@@ -174,7 +236,10 @@ class ModelWithEmbeddings(torch.nn.Module):
                 e.g. on validation of unsupervised_node_classification
 
         """
-        self._get_embeddings(graph, **kwargs)
+        if type(self).embedding_blocks is not ModelWithEmbeddings.embedding_blocks:
+            self.embeddings = self._infer_embeddings(graph, **kwargs)
+        else:
+            self._get_embeddings(graph, **kwargs)
         if self.embeddings is not None:
             self.embeddings = self.embeddings.detach().to("cpu")
         self._get_vectors(graph)
@@ -202,9 +267,48 @@ class ModelWithEmbeddings(torch.nn.Module):
         self.register_buffer('adj_mat', adj_mat)
         return self.adj_mat
 
+    def adjmat_csr_device(self, graph, weighted, directed):
+        """
+            Registers the adjacency in CSR form as buffers adj_indptr, adj_indices and adj_data:
+            O(N + E) memory instead of the O(N^2) of adjmat_device. Read rows with adj_rows().
+        """
+        adj = graph.adjmat(directed=directed, weighted=weighted, sparse=True).tocsr()
+        adj.sort_indices()
+        self.adj_shape = adj.shape
+        self.register_buffer('adj_indptr', torch.from_numpy(adj.indptr.astype(numpy.int64)))
+        self.register_buffer('adj_indices', torch.from_numpy(adj.indices.astype(numpy.int64)))
+        self.register_float_buffer('adj_data', torch.from_numpy(adj.data))
+
+    def adj_rows(self, index, sparse=False):
+        """
+            Rows `index` of the CSR adjacency (see adjmat_csr_device) as a dense
+            (len(index), N) tensor, or as a sparse COO tensor with sparse=True.
+        """
+        index = index.to(self.adj_indptr.device)
+        start = self.adj_indptr[index]
+        count = self.adj_indptr[index + 1] - start
+        row = torch.repeat_interleave(torch.arange(len(index), device=index.device), count)
+        # position in adj_indices = start of the row + offset of the entry within the row
+        offset = torch.arange(len(row), device=index.device) - \
+            torch.repeat_interleave(torch.cumsum(count, 0) - count, count)
+        pos = torch.repeat_interleave(start, count) + offset
+        col = self.adj_indices[pos]
+        val = self.adj_data[pos]
+        shape = (len(index), self.adj_shape[1])
+        if sparse:
+            return torch.sparse_coo_tensor(torch.stack([row, col]), val, shape)
+        return torch.zeros(shape, device=val.device).index_put_((row, col), val)
+
     def after_build(self, graph, **kwargs):
         pass
 
+    def teardown(self, graph, **kwargs):
+        """
+            Releases what after_build set up (e.g. worker processes). Runs after the last epoch,
+            on early stopping and when training raises.
+        """
+        pass
+
     def forward(self, graph, **kwargs):
         kwargs = self.check(type(graph), **kwargs)
         self.vectors = {}
@@ -217,38 +321,45 @@ class ModelWithEmbeddings(torch.nn.Module):
         # print([i for i in self.named_modules()])
         self.after_build(graph, **kwargs)
 
-        if kwargs['_multiple_epochs']:
-            epochs = kwargs['epochs']
-            self.debug("total iter: %i" % epochs)
-        else:
-            epochs = 1
-        time0 = time()
-        for i in range(epochs):
-            self.embeddings = self.train_model(graph, step=i, **kwargs)
-            if kwargs['_multiple_epochs'] and (i + 1) % kwargs['validation_interval'] == 0:
-                for f_v in kwargs['_validation_hooks']:
-                    f_v(self, graph, step=i, **kwargs)
-            if kwargs['_multiple_epochs'] and (i + 1) % kwargs['debug_output_interval'] == 0:
-                if self.debug_info:
-                    self.debug_info += '; '
-                else:
-                    self.debug_info = ''
-                self.debug("epoch {}: {}time used = {}s".format(i + 1, self.debug_info, time() - time0))
-                time0 = time()
-            elif not kwargs['_multiple_epochs']:
-                if self.debug_info:
-                    self.debug_info += '\n'
-                else:
-                    self.debug_info = ''
-                self.debug("{}Time used = {}s".format(self.debug_info, time() - time0))
-                time0 = time()
-            if self.early_stopping_judge(graph, step=i, **kwargs):
-                self.debug("Early stopping condition satisfied. Abort training.")
-                break
+        try:
+            if kwargs['_multiple_epochs']:
+                epochs = kwargs['epochs']
+                self.debug("total iter: %i" % epochs)
+            else:
+                epochs = 1
+            time0 = time()
+            for i in range(epochs):
+                self.embeddings = self.train_model(graph, step=i, **kwargs)
+                if kwargs['_multiple_epochs'] and (i + 1) % kwargs['validation_interval'] == 0:
+                    for f_v in kwargs['_validation_hooks']:
+                        f_v(self, graph, step=i, **kwargs)
+                if kwargs['_multiple_epochs'] and (i + 1) % kwargs['debug_output_interval'] == 0:
+                    if self.debug_info:
+                        self.debug_info += '; '
+                    else:
+                        self.debug_info = ''
+                    self.debug("epoch {}: {}time used = {}s".format(i + 1, self.debug_info, time() - time0))
+                    time0 = time()
+                elif not kwargs['_multiple_epochs']:
+                    if self.debug_info:
+                        self.debug_info += '\n'
+                    else:
+                        self.debug_info = ''
+                    self.debug("{}Time used = {}s".format(self.debug_info, time() - time0))
+                    time0 = time()
+                if self.early_stopping_judge(graph, step=i, **kwargs):
+                    self.debug("Early stopping condition satisfied. Abort training.")
+                    break
+        finally:
+            self.teardown(graph, **kwargs)
         self.make_output(graph, **kwargs)
 
         t2 = time()
         self.debug("Finished training. Time used = {}.".format(t2 - t1))
+        self.save_results()
+        return self.vectors
+
+    def save_results(self):
         if self.save:
             embeddingpath = osp.abspath(osp.join(self.outputpath, self.outputembeddingfile))
             self.debug("Saving embeddings to {}...".format(embeddingpath))
@@ -256,7 +367,6 @@ class ModelWithEmbeddings(torch.nn.Module):
             modelpath = osp.abspath(osp.join(self.outputpath, self.outputmodelfile))
             self.debug("Saving model to {}...".format(modelpath))
             self.save_model(modelpath)
-        return self.vectors
 
     @classmethod
     def args(cls):
@@ -1,9 +1,31 @@
 from __future__ import print_function
 import time
-from gensim.models import Word2Vec
+import random
 from . import walker
+from .walk_cache import WalkCache
+from .skipgram import SkipGram, train_skipgram, train_skipgram_pipelined
+from .sampling import out_degree
+import numpy as np
 import torch
 from .models import *
+
+
+class WalkCorpus:
+    """
+        Restartable iterable over int32 walks as string tokens, for gensim.
+        Tokens are node indices in look_back_list.
+    """
+    def __init__(self, walks):
+        self.walks = walks
+
+    def __iter__(self):
+        for walk in self.walks:
+            yield [str(i) for i in walk.tolist() if i >= 0]
+
+    def __len__(self):
+        return len(self.walks)
+
+
 class Node2vec(ModelWithEmbeddings):
     """
         Make sure graph.G is a networkx.DiGraph. If not, turn it into DiGraph using
@@ -25,38 +47,251 @@ class Node2vec(ModelWithEmbeddings):
                                  'window': 10,
                                  'workers': 8,
                                  'max_vocab_size': None,  #1 << 32,  # 4 GB
+                                 'walk_cache': None,  # directory; reuse alias tables and walks across runs
+                                 'seed': None,
+                                 'trainer': 'gensim',
+                                 'negative_ratio': 5,  # trainer 'torch' only
+                                 'iter': 5,
+                                 'lr': 0.025,
+                                 'batch_size': 16,  # walks per step
+                                 'pipeline': False,  # train while walking; trainer 'torch' only
+                                 'walk_workers': 4,
+                                 'queue_depth': 16,
+                                 'update_lr_scale': 0.1,  # lr factor for already trained rows in update()
                                  })
+        check_range(kwargs, {'trainer': ['gensim', 'torch'],
+                             'negative_ratio': 'positive',
+                             'iter': 'positive',
+                             'lr': 'positive',
+                             'batch_size': 'positive',
+                             'walk_workers': 'positive',
+                             'queue_depth': 'positive',
+                             'update_lr_scale': (0, 1)})
+        if kwargs['pipeline'] and kwargs['trainer'] != 'torch':
+            raise ValueError("pipeline requires trainer 'torch'.")
         return kwargs
 
-    def build(self, graph, *, path_length=80, num_paths=10, p=1.0, q=1.0, **kwargs):
+    def build(self, graph, *, path_length=80, num_paths=10, p=1.0, q=1.0, walk_cache=None, seed=None,
+              pipeline=False, **kwargs):
         if self.dw:
             self.args['hs'] = 1
             p = 1.0
             q = 1.0
         self.args['workers'] = kwargs["workers"]
-
-        if self.dw:
-            self.walker = walker.BasicWalker(graph, workers=kwargs["workers"], silent=self.silent)
+        if seed is not None:
+            seed = int(seed)
+        cache = None
+        if walk_cache is not None:
+            cache = WalkCache(walk_cache, graph, silent=self.silent, dw=self.dw, p=p, q=q,
+                              path_length=path_length, num_paths=num_paths, seed=seed)
+        self.walks = None
+        if cache is not None and cache.has_walks():
+            self.walks = cache.load_walks()
         else:
-            self.walker = walker.Walker(graph, p=p, q=q, workers=kwargs["workers"], silent=self.silent)
-            self.debug("Preprocess transition probs...")
-            self.walker.preprocess_transition_probs()
-        sentences = self.walker.simulate_walks(num_walks=num_paths, walk_length=path_length)
-        self.args["sentences"] = sentences
+            if seed is not None:
+                random.seed(seed)
+            self.make_walker(graph, cache, p=p, q=q, lazy=pipeline, **kwargs)
+            if not pipeline:  # otherwise walks are generated during training
+                self.walks = self.walker.simulate_walks(num_walks=num_paths, walk_length=path_length)
+                if cache is not None:
+                    cache.save_walks(self.walks, shard_size=graph.nodesize)
+        self.args["sentences"] = WalkCorpus(self.walks)
         self.args["size"] = self.dim
         self.args['min_count'] = 0
         self.args['window'] = kwargs['window']
         self.args['sg'] = 1
+        self.args['iter'] = kwargs['iter']
         self.args['max_vocab_size'] = kwargs['max_vocab_size']
+        if seed is not None:
+            self.args['seed'] = seed
+
+    def make_walker(self, graph, cache, *, p, q, lazy=False, **kwargs):
+        """
+            With lazy=True (pipelined training) and no cached alias tables, every walker process computes
+            the alias tables it needs on first use, so training starts without preprocessing the whole graph.
+        """
+        if self.dw:
+            self.walker = walker.BasicWalker(graph, workers=kwargs["workers"], silent=self.silent)
+        else:
+            self.walker = walker.Walker(graph, p=p, q=q, workers=kwargs["workers"], silent=self.silent)
+            if cache is not None and cache.has_alias():
+                self.walker.alias_nodes, self.walker.alias_edges = cache.load_alias()
+            elif lazy:  # partial tables of forked producers are never complete, so nothing is cached
+                self.walker.lazy_transition_probs()
+            else:
+                self.debug("Preprocess transition probs...")
+                self.walker.preprocess_transition_probs()
+                if cache is not None:
+                    cache.save_alias(self.walker.alias_nodes, self.walker.alias_edges)
 
-    def train_model(self, graph, **kwargs):
+    def train_model(self, graph, *, trainer='gensim', **kwargs):
+        if trainer == 'torch':
+            return self.train_skipgram(graph, **kwargs)
+        from gensim.models import Word2Vec
         self.debug("training Word2Vec model...")
         word2vec = Word2Vec(**self.args)
-        self.vectors = {}
         self.debug("Obtaining vectors...")
-        for word in graph.G.nodes():
-            self.vectors[word] = torch.tensor(word2vec.wv[str(word)])
+        # tokens are node indices, so one scatter puts the vocabulary rows in look_back_list order
+        index = torch.from_numpy(np.asarray(word2vec.wv.index2word).astype(np.int64))
+        embeddings = torch.zeros(graph.nodesize, self.dim)
+        embeddings[index] = torch.from_numpy(word2vec.wv.vectors)
         del word2vec
+        return embeddings
+
+    def train_skipgram(self, graph, *, window=10, negative_ratio=5, iter=5, lr=0.025, batch_size=16,
+                       workers=8, seed=None, path_length=80, num_paths=10, walk_workers=4, queue_depth=16,
+                       **kwargs):
+        """
+            Skip-gram with negative sampling on the int32 walks, without gensim.
+            Trains on CPU with `workers` Hogwild processes; DeepWalk also uses negative
+            sampling here instead of hierarchical softmax. Negatives follow degree ** 0.75
+            whether or not the walks are pipelined.
+            If walks were not generated in build (pipeline), `walk_workers` walker processes
+            feed the trainers through a queue of `queue_depth` chunks.
+        """
+        self.debug("training skip-gram model...")
+        self.skipgram = SkipGram(graph.nodesize, self.dim)
+        self.node_list = list(graph.look_back_list)  # row order of the skip-gram tables, for update()
+        self.degree = out_degree(graph)  # kept up to date by update()
+        seed = None if seed is None else int(seed)
+        if self.walks is None:
+            loss, stall = train_skipgram_pipelined(self.skipgram, self.walker, self.degree_noise(),
+                                                   num_walks=num_paths, walk_length=path_length, window=window,
+                                                   negative_ratio=negative_ratio, iters=iter, lr=lr,
+                                                   batch_size=batch_size, workers=workers, walk_workers=walk_workers,
+                                                   queue_depth=queue_depth, seed=seed)
+            self.debug_info = "average loss per pair: {:.5f}; trainers waited on walks for {:.2f}s".format(loss, stall)
+        else:
+            loss = train_skipgram(self.skipgram, self.walks, self.degree_noise(), window=window,
+                                  negative_ratio=negative_ratio,
+                                  iters=iter, lr=lr, batch_size=batch_size, workers=workers, seed=seed)
+            self.debug_info = "average loss per pair: {:.5f}".format(loss)
+        return self.skipgram.in_embeddings.weight.detach()
+
+    def degree_noise(self):
+        """
+            Weighted out-degree ** 0.75, proportional to the expected unigram counts ** 0.75 of the walks.
+        """
+        return self.degree ** 0.75
+
+    @staticmethod
+    def update_degree(graph, degree, changed_edges):
+        """
+            Recomputes the weighted out-degree of the endpoints of changed_edges only.
+        """
+        G, look_up = graph.G, graph.look_up_dict
+        for node in {node for edge in changed_edges for node in edge[:2] if node in G}:
+            degree[look_up[node]] = sum(w for _, _, w in G.edges(node, data='weight', default=1.0))
+        return degree
+
+    @staticmethod
+    def affected_nodes(graph, changed_edges, hops):
+        """
+            Nodes of graph within `hops` hops (in either direction) of an endpoint of a changed edge.
+        """
+        G = graph.G
+        frontier = {node for edge in changed_edges for node in edge[:2] if node in G}
+        seen = set(frontier)
+        for _ in range(hops):
+            nxt = set()
+            for node in frontier:
+                nxt.update(G.neighbors(node))
+                if G.is_directed():
+                    nxt.update(G.predecessors(node))
+            frontier = nxt - seen
+            seen |= frontier
+        return list(seen)
+
+    def previous_state(self):
+        """
+            Node order and skip-gram tables of the last training, from memory or from the saved files.
+        """
+        if getattr(self, 'skipgram', None) is not None and getattr(self, 'node_list', None) is not None:
+            return self.node_list, self.skipgram.in_embeddings.weight.detach(), \
+                   self.skipgram.out_embeddings.weight.detach()
+        if getattr(self, 'outputpath', None) is None:
+            raise FileNotFoundError("No previous training found in memory, and saving is disabled.")
+        state = torch.load(osp.join(self.outputpath, self.outputmodelfile))
+        if 'skipgram.in_embeddings.weight' not in state:
+            raise ValueError("Saved model was not trained with trainer 'torch'.")
+        with open(osp.join(self.outputpath, self.outputembeddingfile)) as fin:
+            fin.readline()
+            node_list = [l.split(' ', 1)[0] for l in fin if l.strip()]  # same order as the table rows
+        return node_list, state['skipgram.in_embeddings.weight'], state['skipgram.out_embeddings.weight']
+
+    def update(self, graph, changed_edges, *, hops=2, **kwargs):
+        """
+            Re-embed graph after the edges in changed_edges ((u, v) pairs) were added or removed, e.g.
+            .. sourcecode:: pycon
+                >>>graph.G.add_edges_from(new_edges)
+                >>>graph.encode_node()
+                >>>model.update(graph, new_edges, **train_args)
+            Walks are regenerated only from nodes within `hops` hops of a changed edge, and the
+            skip-gram continues from the previous embeddings, so the cost follows the size of the
+            change. Requires trainer 'torch'.
+        """
+        kwargs = self.check(**kwargs)
+        if kwargs['trainer'] != 'torch':
+            raise ValueError("Incremental update requires trainer 'torch'.")
+        t1 = time()
+        known = len(self.node_list) if getattr(self, 'skipgram', None) is not None and \
+            getattr(self, 'node_list', None) is not None else 0
+        if known and graph.look_back_list[:known] == self.node_list:
+            # nodes were only appended (the usual case for added edges): keep the tables and the degree
+            # vector, add rows for the new nodes and recompute the degree of the changed endpoints
+            self.skipgram.grow(graph.nodesize)
+            self.node_list.extend(graph.look_back_list[known:])
+            self.degree = torch.cat((self.degree, torch.zeros(graph.nodesize - known, dtype=self.degree.dtype)))
+            self.update_degree(graph, self.degree, changed_edges)
+            warm = slice(0, known)
+        else:
+            # node order changed (or the state comes from saved files): map the previous rows by name
+            node_list, in_weight, out_weight = self.previous_state()
+            self.skipgram = SkipGram(graph.nodesize, self.dim)
+            str_look_up = {str(node): i for i, node in enumerate(graph.look_back_list)}
+            old_index, new_index = [], []
+            for i, node in enumerate(node_list):
+                if str(node) in str_look_up:
+                    old_index.append(i)
+                    new_index.append(str_look_up[str(node)])
+            with torch.no_grad():  # new nodes keep the fresh initialization
+                self.skipgram.in_embeddings.weight[new_index] = in_weight[old_index]
+                self.skipgram.out_embeddings.weight[new_index] = out_weight[old_index]
+            self.node_list = list(graph.look_back_list)
+            self.degree = out_degree(graph)
+            warm = new_index
+        # warm-started rows take smaller steps than the rows of new nodes, so the walks of the
+        # changed region refine the previous embeddings instead of overwriting them
+        self.skipgram.row_lr.fill_(1.)
+        self.skipgram.row_lr[warm] = kwargs['update_lr_scale']
+
+        starts = self.affected_nodes(graph, changed_edges, hops)
+        self.debug("Regenerating walks from {} of {} nodes...".format(len(starts), graph.nodesize))
+        if self.dw:
+            self.walker = walker.BasicWalker(graph, workers=kwargs["workers"], silent=self.silent)
+        else:
+            self.walker = walker.Walker(graph, p=kwargs['p'], q=kwargs['q'], workers=kwargs["workers"],
+                                        silent=self.silent)
+            self.walker.lazy_transition_probs()
+        if kwargs['seed'] is not None:
+            random.seed(int(kwargs['seed']))
+        self.walks = self.walker.simulate_walks(num_walks=kwargs['num_paths'], walk_length=kwargs['path_length'],
+                                                nodes=starts)
+        loss = 0.
+        if len(self.walks):
+            loss = train_skipgram(self.skipgram, self.walks, self.degree_noise(), window=kwargs['window'],
+                                  negative_ratio=kwargs['negative_ratio'], iters=kwargs['iter'], lr=kwargs['lr'],
+                                  batch_size=kwargs['batch_size'], workers=kwargs['workers'],
+                                  seed=None if kwargs['seed'] is None else int(kwargs['seed']))
+        self.embeddings = self.skipgram.in_embeddings.weight.detach()
+        self.make_output(graph, **kwargs)
+        self.debug("Finished update. Average loss per pair: {:.5f}. Time used = {}.".format(loss, time() - t1))
+        self.save_results()
+        return self.vectors
+
+    def _get_vectors(self, graph):
+        self.vectors = EmbeddingVectors(self.embeddings, graph.look_back_list, graph.look_up_dict)
+        return self.vectors
 
 
 class DeepWalk(Node2vec):
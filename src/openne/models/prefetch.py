@@ -0,0 +1,84 @@
+import queue
+import threading
+from time import time
+
+
+class _Failure:
+    def __init__(self, error):
+        self.error = error
+
+
+class BatchPrefetcher:
+    """
+        Produces training batches on background threads, ahead of the training loop.
+
+        produce(rank, workers) returns the iterable of batches of producer `rank`. Batches of all
+        producers pass through one queue holding at most `depth` of them, so sampling overlaps with
+        the optimizer step while memory stays bounded; the order across producers is not kept.
+        Sampling is mostly tensor ops, which release the GIL, so threads are enough.
+        With workers=0 batches are produced in the calling thread.
+
+        `stall` accumulates the seconds the consumer waited for a batch.
+    """
+    _DONE = object()
+
+    def __init__(self, produce, workers=1, depth=16):
+        if depth < 1:  # a queue of maxsize 0 is unbounded
+            raise ValueError("BatchPrefetcher depth must be at least 1, got {}.".format(depth))
+        self.produce = produce
+        self.workers = workers
+        self.depth = depth
+        self.stall = 0.
+
+    def __iter__(self):
+        if self.workers <= 0:
+            batches = iter(self.produce(0, 1))
+            while True:
+                t0 = time()
+                batch = next(batches, self._DONE)
+                self.stall += time() - t0
+                if batch is self._DONE:
+                    return
+                yield batch
+        batch_queue = queue.Queue(maxsize=self.depth)
+        stop = threading.Event()
+        threads = [threading.Thread(target=self._fill, args=(batch_queue, stop, rank), daemon=True)
+                   for rank in range(self.workers)]
+        for t in threads:
+            t.start()
+        running = len(threads)
+        try:
+            while running:
+                t0 = time()
+                batch = batch_queue.get()
+                self.stall += time() - t0
+                if batch is self._DONE:
+                    running -= 1
+                elif isinstance(batch, _Failure):
+                    raise batch.error
+                else:
+                    yield batch
+        finally:  # also reached when the consumer stops early
+            stop.set()
+            for t in threads:
+                t.join()
+
+    def _fill(self, batch_queue, stop, rank):
+        try:
+            for batch in self.produce(rank, self.workers):
+                if not self._put(batch_queue, stop, batch):
+                    return
+        except Exception as e:
+            self._put(batch_queue, stop, _Failure(e))
+            return
+        self._put(batch_queue, stop, self._DONE)
+
+    @staticmethod
+    def _put(batch_queue, stop, item):
+        while not stop.is_set():
+            try:
+                batch_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
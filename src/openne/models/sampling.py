@@ -0,0 +1,42 @@
+import torch
+
+
+class CategoricalSampler:
+    """
+        Draws index i with probability weights[i] / sum(weights).
+        Setup is one O(N) cumulative sum; a batch of draws is one searchsorted call,
+        so no large lookup table is needed. Indices with zero weight are never drawn.
+    """
+    def __init__(self, weights):
+        cdf = torch.cumsum(torch.as_tensor(weights, dtype=torch.float64), 0)
+        if len(cdf) == 0 or cdf[-1] <= 0:
+            raise ValueError("CategoricalSampler needs at least one positive weight.")
+        self.cdf = cdf / cdf[-1]  # float64 keeps the resolution of tiny probabilities in large graphs
+
+    def __len__(self):
+        return len(self.cdf)
+
+    def sample(self, *size):
+        u = torch.rand(size, dtype=torch.float64)
+        return torch.searchsorted(self.cdf, u, right=True).clamp_(max=len(self.cdf) - 1)
+
+
+def out_degree(graph, weighted=True):
+    """
+        (Weighted) out-degree of each node, ordered by look_back_list.
+    """
+    look_up = graph.look_up_dict
+    index = []
+    weight = []
+    for u, _, w in graph.G.edges.data('weight', default=1.0):
+        index.append(look_up[u])
+        weight.append(w if weighted else 1.)
+    return torch.zeros(graph.nodesize, dtype=torch.float64).index_add_(
+        0, torch.tensor(index, dtype=torch.long), torch.tensor(weight, dtype=torch.float64))
+
+
+def degree_sampler(graph, power=0.75):
+    """
+        Degree-biased negative sampler: node i is drawn with probability proportional to out_degree(i) ** power.
+    """
+    return CategoricalSampler(out_degree(graph) ** power)
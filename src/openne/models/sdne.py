@@ -1,5 +1,6 @@
 import numpy as np
 from .models import *
+from .prefetch import BatchPrefetcher
 import torch
 from torch.utils.data import DataLoader
 #from overloading import overload
@@ -136,8 +137,19 @@ class SDNENet(torch.nn.Module):
                 layer.bias = torch.nn.Parameter(rbm.h_bias, True)
                 data = rbm.sample(rbm.forward(data))
 
-    def forward(self, a_b):
-        embeddings = self.encoder(a_b)
+    def encode(self, a_b, sparse_a_b=None):
+        """
+            With sparse_a_b (the same batch as a sparse tensor), the input layer is computed by SpMM,
+            which costs O(nnz * hidden) instead of O(batch * N * hidden).
+        """
+        if sparse_a_b is None or isinstance(self.encoder, torch.nn.DataParallel):
+            return self.encoder(a_b)
+        first = self.encoder[0]
+        hidden = torch.sparse.mm(sparse_a_b, first.weight.t()) + first.bias
+        return self.encoder[1:](hidden)
+
+    def forward(self, a_b, sparse_a_b=None):
+        embeddings = self.encode(a_b, sparse_a_b)
         final = self.decoder(embeddings)
         return embeddings, final
 
@@ -185,56 +197,106 @@ class SDNE(ModelWithEmbeddings):
                                  'lr': 0.001,
                                  'decay': False,
                                  'pretrain': False,
+                                 'sparse_input': False,
+                                 'prefetch_workers': 1,
+                                 'prefetch_depth': 16,
                                  'data_parallel': False})
         check_range(kwargs, {'batch_size': (0, np.inf),
                              'epochs': (0, np.inf),
                              'lr': (0, np.inf),
+                             'prefetch_workers': (0, np.inf),
+                             'prefetch_depth': (1, np.inf),
                              'decay': [True, False, 0, 1],
-                             'pretrain': [True, False, 0, 1]})
+                             'pretrain': [True, False, 0, 1],
+                             'sparse_input': [True, False, 0, 1]})
         return kwargs
 
     def build(self, graph, *, batch_size=200, epochs=100, lr=0.001, decay=False,
-              pretrain=False, data_parallel=False, **kwargs):
+              pretrain=False, sparse_input=False, data_parallel=False, prefetch_workers=1, prefetch_depth=16,
+              **kwargs):
         self.node_size = graph.nodesize
         self.dim = self.encoder_layer_list[-1]
         encoder_layer_list = [self.node_size]
         encoder_layer_list.extend(self.encoder_layer_list)
         self.encoder_layer_num = len(encoder_layer_list) + 1
         self.bs = batch_size
-        self.epochs = (epochs * self.node_size) // batch_size
+        # an epoch is one pass over a shuffled permutation of the nodes
+        self.steps_per_epoch = (self.node_size + batch_size - 1) // batch_size
         self.real_epochs = epochs
+        self.cur_epoch = 0
+        self.global_step = 0
+        self.perm_seed = int(torch.randint(1 << 31, (1,)))
         self.decay = decay
         self.pretrain = pretrain
         self.data_parallel = data_parallel
+        self.sparse_input = sparse_input
         if self.decay:
             self.lr = lambda x: lr / (1 + 0.9999 * x)
         else:
             self.lr = lambda x: lr
-        self.adjmat_device(graph, weighted=True, directed=True)
+        # CSR adjacency; only the rows of a batch are ever made dense
+        self.adjmat_csr_device(graph, weighted=True, directed=True)
         self.model = SDNENet(encoder_layer_list, self.alpha, self.nu1, self.nu2,
                              data_parallel=data_parallel, devices=kwargs['devices'], silent=self.silent)
 
-        if self.pretrain:
-            self.model.pretrain(self.adj_mat)
+        if self.pretrain:  # full-batch RBM pretraining still needs the dense matrix
+            self.model.pretrain(self.adj_rows(torch.arange(self.node_size)))
         self.optimizer = torch.optim.Adam(self.model.parameters(), lr=self.lr(0))
+        self.prefetch_workers = prefetch_workers
+        self.prefetch_depth = prefetch_depth
+        self.stall = 0.
 
-    def train_model(self, graph, *, step=0, **kwargs):
-        index = torch.randint(high=self.node_size,
-                              size=[self.bs])
-        adj_batch_train = self.adj_mat[index, :]
-        adj_mat_train = adj_batch_train[:, index]
-        b_mat_train = torch.ones_like(adj_batch_train)
-        b_mat_train[adj_batch_train != 0] = self.beta
-
-        self.optimizer.zero_grad()
-        embeddings, final = self.model(adj_batch_train)
-        loss, l1, l2 = self.model.loss(adj_batch_train, adj_mat_train, b_mat_train, embeddings, final)
-        loss.backward()
-        self.optimizer.step()
-        if self.decay:
-            adjust_lr(self.optimizer, step, decay_strategy=self.lr)
-        self.debug_info = "total loss: {:.5f}, l1 loss: {:.5f}, l2 loss: {:.5f}".format(loss, float(l1), float(l2))
-
-    def _get_embeddings(self, graph, **kwargs):
-        embeddings, _ = self.model(self.adj_mat)
-        self.embeddings = embeddings.detach()
+    def batch_iter(self, epoch, rank, workers):
+        """
+            Producer `rank` yields every workers-th batch of `epoch`. The permutation of an epoch is
+            seeded by its number, so all producers agree on it without sharing state.
+        """
+        generator = torch.Generator().manual_seed(self.perm_seed + epoch)
+        perm = torch.randperm(self.node_size, generator=generator)
+        for index in perm.split(self.bs)[rank::workers]:
+            sparse_batch_train = None
+            if self.sparse_input:
+                sparse_batch_train = self.adj_rows(index, sparse=True)
+                adj_batch_train = sparse_batch_train.to_dense()
+            else:
+                adj_batch_train = self.adj_rows(index)
+            adj_mat_train = adj_batch_train[:, index.to(adj_batch_train.device)]
+            b_mat_train = torch.ones_like(adj_batch_train)
+            b_mat_train[adj_batch_train != 0] = self.beta
+            yield adj_batch_train, adj_mat_train, b_mat_train, sparse_batch_train
+
+    def train_model(self, graph, **kwargs):
+        """
+            One epoch: exactly the batches of this epoch's permutation, built by background threads
+            that only work on this epoch, so epochs never interleave.
+        """
+        t0 = time()
+        sum_loss = sum_l1 = sum_l2 = 0.
+        epoch, self.cur_epoch = self.cur_epoch, self.cur_epoch + 1
+        prefetcher = BatchPrefetcher(lambda rank, workers: self.batch_iter(epoch, rank, workers),
+                                     self.prefetch_workers, self.prefetch_depth)
+        for adj_batch_train, adj_mat_train, b_mat_train, sparse_batch_train in prefetcher:
+            self.optimizer.zero_grad()
+            embeddings, final = self.model(adj_batch_train, sparse_batch_train)
+            loss, l1, l2 = self.model.loss(adj_batch_train, adj_mat_train, b_mat_train, embeddings, final)
+            loss.backward()
+            self.optimizer.step()
+            self.global_step += 1
+            if self.decay:
+                adjust_lr(self.optimizer, self.global_step, decay_strategy=self.lr)
+            sum_loss += float(loss)
+            sum_l1 += float(l1)
+            sum_l2 += float(l2)
+        self.stall += prefetcher.stall
+        self.debug_info = "total loss: {:.5f}, l1 loss: {:.5f}, l2 loss: {:.5f}, steps/s: {:.1f}, " \
+                          "sampling stall: {:.2f}s".format(sum_loss, sum_l1, sum_l2,
+                                                          self.steps_per_epoch / max(time() - t0, 1e-9),
+                                                          self.stall)
+
+    def embedding_blocks(self, graph, chunk_size, **kwargs):
+        for index in torch.arange(self.node_size).split(chunk_size):
+            if self.sparse_input and not isinstance(self.model.encoder, torch.nn.DataParallel):
+                # the dense rows are only read by the DataParallel encoder
+                yield self.model.encode(None, self.adj_rows(index, sparse=True))
+            else:
+                yield self.model.encode(self.adj_rows(index))
@@ -0,0 +1,217 @@
+import math
+import threading
+from time import time
+import torch
+import torch.multiprocessing as mp
+import torch.nn as nn
+import torch.nn.functional as F
+from .hogwild import hogwild, worker_threads
+from .sampling import CategoricalSampler
+
+
+def make_pairs(walks, window, dynamic=True):
+    """
+        Build (center, context) pairs from a batch of walks in vectorized form.
+        :param walks: LongTensor (num_walks, walk_length) of node indices, padded with -1.
+        :param window: maximum distance between center and context.
+        :param dynamic: shrink the window of each center uniformly in [1, window], as word2vec does.
+        :return: center, context (LongTensors of the same length)
+    """
+    if dynamic:
+        reach = torch.randint(1, window + 1, walks.shape)
+    centers = []
+    contexts = []
+    for offset in range(1, min(window, walks.shape[1] - 1) + 1):
+        left, right = walks[:, :-offset], walks[:, offset:]
+        valid = (left >= 0) & (right >= 0)
+        fwd, bwd = valid, valid
+        if dynamic:
+            fwd = valid & (reach[:, :-offset] >= offset)
+            bwd = valid & (reach[:, offset:] >= offset)
+        centers.extend([left[fwd], right[bwd]])
+        contexts.extend([right[fwd], left[bwd]])
+    if not centers:
+        empty = torch.zeros(0, dtype=torch.long)
+        return empty, empty
+    return torch.cat(centers), torch.cat(contexts)
+
+
+class SkipGram(nn.Module):
+    """
+        Skip-gram with negative sampling on node indices.
+        Both tables use sparse gradients, so one step only touches the rows in the batch.
+        row_lr scales the learning rate of each node's rows (e.g. lowered for warm-started rows).
+    """
+    def __init__(self, node_size, dim):
+        super(SkipGram, self).__init__()
+        self.node_size = node_size
+        self.dim = dim
+        self.in_embeddings = nn.Embedding(node_size, dim, sparse=True)
+        self.out_embeddings = nn.Embedding(node_size, dim, sparse=True)
+        nn.init.uniform_(self.in_embeddings.weight, -0.5 / dim, 0.5 / dim)
+        nn.init.zeros_(self.out_embeddings.weight)
+        self.register_buffer('row_lr', torch.ones(node_size))
+
+    def forward(self, center, context, negatives):
+        emb_c = self.in_embeddings(center)
+        pos = (emb_c * self.out_embeddings(context)).sum(1)
+        neg = torch.bmm(self.out_embeddings(negatives), emb_c.unsqueeze(2)).squeeze(2)
+        return -(F.logsigmoid(pos).sum() + F.logsigmoid(-neg).sum())
+
+    def grow(self, node_size):
+        """
+            Appends freshly initialized rows for node indices self.node_size .. node_size - 1.
+        """
+        if node_size <= self.node_size:
+            return
+        fresh = SkipGram(node_size - self.node_size, self.dim)
+        with torch.no_grad():
+            for name in ('in_embeddings', 'out_embeddings'):
+                table = nn.Embedding(node_size, self.dim, sparse=True)
+                table.weight.copy_(torch.cat((getattr(self, name).weight, getattr(fresh, name).weight)))
+                setattr(self, name, table)
+        self.row_lr = torch.cat((self.row_lr, fresh.row_lr))
+        self.node_size = node_size
+
+    def scale_gradients(self, center, context, negatives):
+        """
+            Replaces each row's summed gradient by its mean over the pairs of the batch that use the row,
+            times row_lr. A hub row thus takes one step of word2vec's per-pair size instead of the sum
+            of its many same-point gradients.
+        """
+        uses = {self.in_embeddings: torch.bincount(center, minlength=self.node_size),
+                self.out_embeddings: torch.bincount(torch.cat((context, negatives.reshape(-1))),
+                                                    minlength=self.node_size)}
+        for table, count in uses.items():
+            grad = table.weight.grad.coalesce()
+            rows = grad.indices()[0]
+            scale = (self.row_lr[rows] / count[rows].clamp(min=1).to(self.row_lr.dtype)).unsqueeze(1)
+            table.weight.grad = torch.sparse_coo_tensor(grad.indices(), grad.values() * scale, grad.size())
+
+
+def _step(model, optimizer, walks, sampler, window, negative_ratio, lr):
+    center, context = make_pairs(walks.long(), window)
+    if len(center) == 0:
+        return 0., 0
+    negatives = sampler.sample(len(center), negative_ratio)
+    for group in optimizer.param_groups:
+        group['lr'] = lr
+    optimizer.zero_grad()
+    loss = model(center, context, negatives)
+    loss.backward()
+    model.scale_gradients(center, context, negatives)
+    optimizer.step()
+    return float(loss), len(center)
+
+
+def _decayed(lr, progress):  # linear decay as in word2vec
+    return lr * max(1. - progress, 1e-4)
+
+
+def _train_worker(rank, model, walks, noise, window, negative_ratio, iters, lr, batch_size, workers, seed, threads):
+    torch.set_num_threads(threads)
+    if seed is not None:
+        torch.manual_seed(seed + rank)
+    shard = walks[rank::workers]
+    optimizer = torch.optim.SGD(model.parameters(), lr=lr)
+    sampler = CategoricalSampler(noise)
+    batches = int(math.ceil(len(shard) / batch_size))
+    total = max(1, iters * batches)
+    step = 0
+    sum_loss = 0.
+    num_pairs = 0
+    for _ in range(iters):
+        perm = torch.randperm(len(shard))
+        for start in range(0, len(shard), batch_size):
+            step += 1
+            loss, pairs = _step(model, optimizer, shard[perm[start:start + batch_size]], sampler, window,
+                                negative_ratio, _decayed(lr, step / total))
+            sum_loss += loss
+            num_pairs += pairs
+    return sum_loss, num_pairs
+
+
+def train_skipgram(model, walks, noise, *, window=10, negative_ratio=5, iters=5, lr=0.025, batch_size=16,
+                   workers=1, seed=None):
+    """
+        Train `model` (a SkipGram) on int32 walks with Hogwild-style multi-process SGD.
+        Each worker owns a shard of the walks and updates the shared tables lock-free.
+        Negatives are drawn in proportion to `noise` (e.g. node degree ** 0.75, as for the pipelined trainer).
+        :return: average loss per (center, context) pair
+    """
+    walks = walks.share_memory_()
+    model.share_memory()
+    threads = worker_threads(workers)
+    res = hogwild(_train_worker, workers, model, walks, noise, window, negative_ratio, iters, lr, batch_size,
+                  workers, seed, threads)
+    sum_loss = sum(r[0] for r in res)
+    num_pairs = sum(r[1] for r in res)
+    return sum_loss / max(1, num_pairs)
+
+
+def _consume_worker(rank, model, walk_queue, progress, expected, noise, window, negative_ratio, iters, lr,
+                    batch_size, seed, threads):
+    torch.set_num_threads(threads)
+    if seed is not None:
+        torch.manual_seed(seed + rank)
+    optimizer = torch.optim.SGD(model.parameters(), lr=lr)
+    sampler = CategoricalSampler(noise)
+    sum_loss = 0.
+    num_pairs = 0
+    stall = 0.
+    while True:
+        t0 = time()
+        chunk = walk_queue.get()
+        stall += time() - t0
+        if chunk is None:
+            break
+        chunk = torch.from_numpy(chunk)
+        with progress.get_lock():
+            progress.value += len(chunk)
+            cur_lr = _decayed(lr, progress.value / expected)
+        for _ in range(iters):
+            perm = torch.randperm(len(chunk))
+            for start in range(0, len(chunk), batch_size):
+                loss, pairs = _step(model, optimizer, chunk[perm[start:start + batch_size]], sampler, window,
+                                    negative_ratio, cur_lr)
+                sum_loss += loss
+                num_pairs += pairs
+    return sum_loss, num_pairs, stall
+
+
+def train_skipgram_pipelined(model, walker, noise, *, num_walks, walk_length, window=10, negative_ratio=5,
+                             iters=5, lr=0.025, batch_size=16, workers=1, walk_workers=1, queue_depth=16,
+                             chunk_size=256, seed=None):
+    """
+        Train `model` while walks are being generated.
+        `walk_workers` walker processes fill a bounded queue with chunks of `chunk_size` walks;
+        `workers` Hogwild trainer processes consume them, passing `iters` times over each chunk.
+        The corpus is never materialized, so the noise distribution is given up front
+        (e.g. node degree ** 0.75, which is proportional to the expected visit counts).
+        :return: average loss per (center, context) pair, total seconds trainers waited on the queue
+    """
+    model.share_memory()
+    walk_queue = mp.Queue(maxsize=queue_depth)
+    producers = walker.start_producers(walk_queue, walk_workers, num_walks, walk_length, chunk_size, seed)
+
+    def close():
+        for p in producers:
+            p.join()
+        for _ in range(workers):
+            walk_queue.put(None)
+
+    closer = threading.Thread(target=close, daemon=True)
+    closer.start()
+    progress = mp.Value('l', 0)
+    expected = max(1, num_walks * walker.node_size)
+    main_threads = torch.get_num_threads()
+    res = hogwild(_consume_worker, workers, model, walk_queue, progress, expected, noise, window,
+                  negative_ratio, iters, lr, batch_size, seed, worker_threads(workers + walk_workers))
+    torch.set_num_threads(main_threads)
+    closer.join()
+    for p in producers:
+        if p.exitcode != 0:
+            raise RuntimeError("Walker process (PID {}) exited with code {}.".format(p.pid, p.exitcode))
+    sum_loss = sum(r[0] for r in res)
+    num_pairs = sum(r[1] for r in res)
+    return sum_loss / max(1, num_pairs), sum(r[2] for r in res)
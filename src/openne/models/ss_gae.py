@@ -1,7 +1,9 @@
 import numpy as np
 from .gcn.utils import *
 from .models import *
+from .features import reduced_features, check_feature_parameters
 from .ss_model import SSModel
+from .prefetch import BatchPrefetcher
 import time
 import scipy.sparse as sp
 import torch
@@ -26,14 +28,19 @@ class SS_GAE(ModelWithEmbeddings):
                                  "early_stopping": 100,
                                  "clf_ratio": 0.5,
                                  "hiddens": [32],
-                                 "max_degree": 0})
+                                 "max_degree": 0,
+                                 "prefetch_workers": 1,
+                                 "prefetch_depth": 16})
         check_range(kwargs, {"learning_rate": (0, np.inf),
                              "epochs": (0, np.inf),
                              "dropout": (0, 1),
                              "weight_decay": (0, 1),
                              "early_stopping": (0, np.inf),
                              "clf_ratio": (0, 1),
-                             "max_degree": (0, np.inf)})
+                             "max_degree": (0, np.inf),
+                             "prefetch_workers": (0, np.inf),
+                             "prefetch_depth": (1, np.inf)})
+        check_feature_parameters(kwargs)
         return kwargs
     
     @classmethod
@@ -43,7 +50,8 @@ class SS_GAE(ModelWithEmbeddings):
 
     def build(self, graph, *, learning_rate=0.01, epochs=200,
               dropout=0., weight_decay=1e-4, early_stopping=100,
-              clf_ratio=0.5, batch_size=10000, enc='linear', dec='mlp', sampler='node-nei-random', **kwargs):
+              clf_ratio=0.5, batch_size=10000, enc='linear', dec='mlp', sampler='node-nei-random',
+              prefetch_workers=1, prefetch_depth=16, **kwargs):
         """
                         learning_rate: Initial learning rate
                         epochs: Number of epochs to train
@@ -64,9 +72,11 @@ class SS_GAE(ModelWithEmbeddings):
         self.enc = enc
         self.dec = dec
         self.sampler = sampler
+        self.prefetch_workers = prefetch_workers
+        self.prefetch_depth = prefetch_depth
+        self.stall = 0.
         
-        
-        self.preprocess_data(graph)
+        self.preprocess_data(graph, **kwargs)
         # Create models
         input_dim = self.features.shape[1] if not self.sparse else self.features[2][1]
         feature_shape = self.features.shape if not self.sparse else self.features[0].shape[0]
@@ -85,7 +95,7 @@ class SS_GAE(ModelWithEmbeddings):
     def train_model(self, graph, **kwargs):
         # Train models
         output, train_loss,  __ = self.evaluate()
-        self.debug_info =str({"train_loss": "{:.5f}".format(train_loss)})
+        self.debug_info =str({"train_loss": "{:.5f}".format(train_loss), "sampling_stall": "{:.2f}s".format(self.stall)})
         
     def build_label(self, graph):
         g = graph.G
@@ -121,13 +131,13 @@ class SS_GAE(ModelWithEmbeddings):
         #neg_inds = self.features[torch.tensor(neg)]
         cur_loss = 0.
         batch_num = 0.
-        for batch in self.model.sampler:
-            x, pos, neg = zip(*batch)
+        # sampling runs inside the producer threads, overlapping with the optimizer steps
+        sampler = self.model.sampler
+        batches = BatchPrefetcher(lambda r, n: ([t.to(self._device) for t in chunk] for chunk in sampler.chunks(r, n)),
+                                  self.prefetch_workers, self.prefetch_depth)
+        for bx, bpos, bneg in batches:
             self.optimizer.zero_grad()
-            bx = torch.tensor(list(x))
-            bpos = torch.tensor(list(pos))
-            bneg = torch.tensor(list(neg))
-            lbl_1 = torch.ones(1, len(x))
+            lbl_1 = torch.ones(1, len(bx))
             lbl = torch.cat((lbl_1, 1-lbl_1), 1).to(self._device)
             batch_num += 1
             output = self.model(bx, bpos, bneg)
@@ -137,21 +147,23 @@ class SS_GAE(ModelWithEmbeddings):
                 self.optimizer.step()
 
             cur_loss += loss.item()
-        
-        return output, cur_loss / batch_num, (time.time() - t_test)
+        self.stall += batches.stall
 
-    def _get_embeddings(self, graph, **kwargs):
+        return output, cur_loss / batch_num, (time.time() - t_test)
 
-        self.embeddings = self.model.embed(torch.tensor(range(self.nb_nodes))).detach()
+    def embedding_blocks(self, graph, chunk_size, **kwargs):
+        for index in torch.arange(self.nb_nodes).split(chunk_size):
+            yield self.model.embed(index.to(self._device))
 
-    def preprocess_data(self, graph):
+    def preprocess_data(self, graph, **kwargs):
         """
             adj, features, y_train, y_val, y_test, train_mask, val_mask, test_mask
             y_train, y_val, y_test can merge to y
         """
         g = graph.G
-        features = torch.from_numpy(graph.features()).type(torch.float32)
-        features = preprocess_features(features, sparse=self.sparse)
+        # row-normalized (see preprocess_features) and optionally reduced, see --feature-reduce
+        features = torch.from_numpy(reduced_features(graph, row_normalize=True, debug=self.debug, **kwargs))
+        features = features.to_sparse() if self.sparse else features
         self.register_buffer("features", features)
         n = graph.nodesize
         self.build_label(graph)
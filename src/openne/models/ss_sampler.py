@@ -33,6 +33,15 @@ class BaseSampler(Sampler):
     def __len__(self):
         return (len(self.sampler) + self.batch_size - 1) // self.batch_size
 
+    def chunks(self, rank=0, workers=1):
+        """
+            Yields every workers-th batch, starting with batch `rank`, of one epoch as (x, pos, neg) index
+            tensors. Samples of a batch are drawn when it is produced, i.e. on the producer's thread.
+        """
+        size = len(self.sampler)
+        for start in range(rank * self.batch_size, size, workers * self.batch_size):
+            yield self.sampler.sample(start, min(start + self.batch_size, size))
+
     
 class NNRSampler(Sampler):
     def __init__(self, adj, nnodes, nedges):
@@ -48,6 +57,15 @@ class NNRSampler(Sampler):
         negind = torch.randint(high=self.nnodes, size=(self.nedges,)).tolist()
         return iter(list(zip(xind, yind, negind)))
 
+    def __len__(self):
+        return self.nedges
+
+    def sample(self, start=0, end=None):
+        """ samples start .. end of an epoch: the edges in that range, each with a random negative node """
+        end = self.nedges if end is None else end
+        return self.adj_ind[0][start:end], self.adj_ind[1][start:end], \
+            torch.randint(high=self.nnodes, size=(end - start,))
+
 sampler_dict = {
     "node-nei-random": NNRSampler
 }
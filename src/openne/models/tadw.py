@@ -3,9 +3,12 @@ import math
 import numpy as np
 import torch
 from numpy import linalg as la
+import scipy.sparse as sp
 import scipy.sparse.linalg as lg
 from sklearn.preprocessing import normalize
 from .models import *
+from .factorization import check_svd_parameters
+from .features import reduced_features, check_feature_parameters
 
 
 class TADW(ModelWithEmbeddings):
@@ -14,15 +17,9 @@ class TADW(ModelWithEmbeddings):
         super(TADW, self).__init__(dim=dim // 2, lamb=lamb, **kwargs)
 
     @staticmethod
-    def getT(graph):
-        g = graph.G
-        look_back = graph.look_back_list
-        features = torch.from_numpy(graph.features())
-        if features.shape[1] > 200:
-            U, S, VT = lg.svds(features, k=200)
-            Ud = torch.from_numpy(U)
-            Sd = torch.from_numpy(S)
-            features = Ud * Sd
+    def getT(graph, debug=None, **kwargs):
+        # features wider than feature_dim (200 by default) are reduced, by truncated SVD by default
+        features = torch.from_numpy(reduced_features(graph, debug=debug, **kwargs))
         return features.t()
 
     @classmethod
@@ -30,6 +27,8 @@ class TADW(ModelWithEmbeddings):
         check_existance(kwargs, {'dim': 128,
                                  'lamb': 0.4,
                                  'epochs': 20})
+        check_svd_parameters(kwargs)
+        check_feature_parameters(kwargs, feature_reduce='svd')
         assert kwargs['dim'] % 2 == 0
         return kwargs
 
@@ -39,58 +38,56 @@ class TADW(ModelWithEmbeddings):
             raise TypeError("TADW only accepts attributed graphs.")
 
     def build(self, graph, **kwargs):
-        self.adj = torch.from_numpy(graph.adjmat(weighted=False, directed=False, scaled=1)).type(torch.float32)
-        # M = (A + A^2) / 2, A = adj (row-normalized adjmat)
-        self.M = (self.adj + torch.mm(self.adj, self.adj)) / 2
+        # A: row-normalized adjacency, kept sparse; M = (A + A^2) / 2 is only applied through A
+        adj = sp.csr_matrix(graph.adjmat(weighted=False, directed=False, sparse=True), dtype=np.float32)
+        degree = np.asarray(adj.sum(1)).ravel()
+        adj = (sp.diags(np.divide(1., degree, out=np.zeros_like(degree), where=degree > 0)) @ adj).tocoo()
+        self.adj = torch.sparse_coo_tensor(torch.from_numpy(np.vstack((adj.row, adj.col)).astype(np.int64)),
+                                           torch.from_numpy(adj.data), adj.shape).coalesce()
         # T: text feature matrix (feature_size * node_num)
-        self.T = self.getT(graph)
+        self.T = self.getT(graph, debug=self.debug, **kwargs).float()
         self.node_size = graph.nodesize
         self.feature_size = self.T.shape[0]
         self.W = torch.randn(self.dim, self.node_size)
         self.H = torch.randn(self.dim, self.feature_size)
+        # the feature Gram matrix T T^T never changes: its eigendecomposition is computed once
+        self.T_eig = self._eigh(torch.mm(self.T, self.T.t()))
+
+    def M_mm(self, X):
+        """ M X for a dense (node_size, k) X, M = (A + A^2) / 2 """
+        AX = torch.sparse.mm(self.adj, X)
+        return (AX + torch.sparse.mm(self.adj, AX)) / 2
+
+    @staticmethod
+    def _eigh(G):
+        G = G.double()
+        if hasattr(torch, 'linalg') and hasattr(torch.linalg, 'eigh'):
+            return torch.linalg.eigh(G)
+        return torch.symeig(G, eigenvectors=True)
 
     def train_model(self, graph, **kwargs):  # todo: rewrite with learning-models-based method
+        # Both updates take the step that the conjugate gradient loops used to approximate: the linear
+        # systems have Kronecker structure and are solved exactly through d x d (and f x f) factorizations.
 
-        # Update W
+        # Update W: (2 B B^T + lamb I) dW = -drv for all node_size columns at once
         B = torch.mm(self.H, self.T)
-        drv = 2 * torch.mm(torch.mm(B, B.t()), self.W) - \
-              2 * torch.mm(B, self.M.t()) + self.lamb * self.W
+        BMt = self.M_mm(B.t()).t()  # B M^T
         Hess = 2 * torch.mm(B, B.t()) + self.lamb * torch.eye(self.dim)
-        drv = torch.reshape(drv, [self.dim * self.node_size, 1])
-        rt = -drv
-        dt = rt
-        vecW = torch.reshape(self.W, [self.dim * self.node_size, 1])
-        while torch.norm(rt, 2) > 1e-4:
-            dtS = torch.reshape(dt, (self.dim, self.node_size))
-            Hdt = torch.reshape(torch.mm(Hess, dtS), [
-                self.dim * self.node_size, 1])
-
-            at = torch.mm(rt.t(), rt) / torch.mm(dt.t(), Hdt)
-            vecW = vecW + at * dt
-            rtmp = rt
-            rt = rt - at * Hdt
-            bt = torch.mm(rt.t(), rt) / torch.mm(rtmp.t(), rtmp)  # np.dot(rt.T, rt)/np.dot(rtmp.T, rtmp)
-            dt = rt + bt * dt
-        self.W = torch.reshape(vecW, (self.dim, self.node_size))  # np
+        drv = torch.mm(Hess, self.W) - 2 * BMt
+        Hess = Hess.double()
+        L = torch.linalg.cholesky(Hess) if hasattr(torch, 'linalg') and hasattr(torch.linalg, 'cholesky') \
+            else torch.cholesky(Hess)
+        self.W = self.W - torch.cholesky_solve(drv.double(), L).float()
 
-        # Update H
-        drv = 2 * torch.mm((torch.mm(torch.mm(torch.mm(self.W, self.W.t()), self.H), self.T)
-                            - torch.mm(self.W, self.M.t())), self.T.t()) + self.lamb * self.H
-        drv = torch.reshape(drv, (self.dim * self.feature_size, 1))
-        rt = -drv
-        dt = rt
-        vecH = torch.reshape(self.H, (self.dim * self.feature_size, 1))
-        while torch.norm(rt, 2) > 1e-4:
-            dtS = torch.reshape(dt, (self.dim, self.feature_size))
-            Hdt = torch.reshape(torch.mm(torch.mm(torch.mm(self.W, self.W.t()), dtS), torch.mm(self.T, self.T.t()))
-                                + self.lamb * dtS, (self.dim * self.feature_size, 1))
-            at = torch.mm(rt.t(), rt) / torch.mm(dt.t(), Hdt)
-            vecH = vecH + at * dt
-            rtmp = rt
-            rt = rt - at * Hdt
-            bt = torch.mm(rt.t(), rt) / torch.mm(rtmp.t(), rtmp)
-            dt = rt + bt * dt
-        self.H = torch.reshape(vecH, (self.dim, self.feature_size))
+        # Update H: (W W^T) dH (T T^T) + lamb dH = -drv, diagonalized by the eigenvectors of both Gram matrices
+        WWt = torch.mm(self.W, self.W.t())
+        WMt = self.M_mm(self.W.t()).t()  # W M^T
+        TTt_values, TTt_vectors = self.T_eig
+        drv = 2 * torch.mm(torch.mm(torch.mm(WWt, self.H), self.T) - WMt, self.T.t()) + self.lamb * self.H
+        WWt_values, WWt_vectors = self._eigh(WWt)
+        rotated = torch.mm(torch.mm(WWt_vectors.t(), drv.double()), TTt_vectors)
+        step = rotated / (WWt_values.unsqueeze(1) * TTt_values.unsqueeze(0) + self.lamb)
+        self.H = self.H - torch.mm(torch.mm(WWt_vectors, step), TTt_vectors.t()).float()
 
     def _get_embeddings(self, graph, **kwargs):
         self.embeddings = torch.cat((
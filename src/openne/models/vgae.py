@@ -3,6 +3,7 @@ from .gcn.utils import *
 from .gcn.layers import GraphConvolution
 from .gcn.layers import *
 from .models import *
+from .features import reduced_features, check_feature_parameters
 import time
 import scipy.sparse as sp
 import torch
@@ -26,6 +27,14 @@ class VGAEModel(nn.Module):
             hidden1 = layer(hidden1)
         return self.gcm(hidden1), self.gcv(hidden1)
 
+    def mu_blocks(self, x, chunk_size):
+        """
+            The means of encode(x) in blocks of chunk_size rows.
+        """
+        for layer in self.layers:
+            x = layer(x)
+        return self.gcm.forward_blocks(x, chunk_size)
+
     def reparameterize(self, mu, logvar):
         if self.training:
             std = torch.exp(logvar)
@@ -64,6 +73,7 @@ class VGAE(ModelWithEmbeddings):
                              "early_stopping": (0, np.inf),
                              "clf_ratio": (0, 1),
                              "max_degree": (0, np.inf)})
+        check_feature_parameters(kwargs)
         return kwargs
 
     @classmethod
@@ -88,7 +98,7 @@ class VGAE(ModelWithEmbeddings):
         self.dropout = dropout
         self.weight_decay = weight_decay
         self.early_stopping = early_stopping
-        self.preprocess_data(graph)
+        self.preprocess_data(graph, **kwargs)
         # Create models
         input_dim = self.features.shape[1]
 
@@ -145,19 +155,19 @@ class VGAE(ModelWithEmbeddings):
             self.optimizer.step()
         return output, loss, (time.time() - t_test)
 
-    def _get_embeddings(self, graph, **kwargs):
-        output, mu, var = self.model(self.features)
-        self.embeddings = mu.detach()
+    def embedding_blocks(self, graph, chunk_size, **kwargs):
+        return self.model.mu_blocks(self.features, chunk_size)
 
-    def preprocess_data(self, graph):
+    def preprocess_data(self, graph, **kwargs):
         """
             adj, features, y_train, y_val, y_test, train_mask, val_mask, test_mask
             y_train, y_val, y_test can merge to y
         """
         g = graph.G
         look_back = graph.look_back_list
-        features = torch.from_numpy(graph.features()).type(torch.float32)
-        features = preprocess_features(features, sparse=self.sparse)
+        # row-normalized (see preprocess_features) and optionally reduced, see --feature-reduce
+        features = torch.from_numpy(reduced_features(graph, row_normalize=True, debug=self.debug, **kwargs))
+        features = features.to_sparse() if self.sparse else features
         self.register_buffer("features", features)
         n = graph.nodesize
         self.n_nodes = n
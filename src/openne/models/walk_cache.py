@@ -0,0 +1,78 @@
+import hashlib
+import json
+import torch
+from ..utils import *
+
+
+class WalkCache:
+    """
+        On-disk cache of alias tables and walk corpora for Node2vec / DeepWalk.
+
+        Entries are keyed by the graph fingerprint and the walk parameters
+        (p, q, path_length, num_paths, seed), so sweeps over Word2Vec settings
+        only repeat the embedding training. Walks are stored as int32 shards
+        (one shard per walk epoch, padded with -1) of node indices in look_back_list.
+        Every entry (alias tables, walks) has its own meta file, written last and atomically; an
+        entry without it is treated as missing. Concurrent runs thus never overwrite each other's
+        meta data, and the meta of an entry only ever refers to complete files.
+    """
+
+    def __init__(self, root, graph, silent=False, **key):
+        self.silent = silent
+        self.key = key
+        digest = hashlib.sha1('{}{}'.format(graph.fingerprint(), sorted(key.items())).encode()).hexdigest()
+        self.path = osp.join(osp.abspath(root), digest)
+        makedirs(self.path)
+
+    def _file(self, name):
+        return osp.join(self.path, name)
+
+    def _save(self, obj, name):
+        tmp = self._file('{}.{}.tmp'.format(name, os.getpid()))
+        torch.save(obj, tmp)
+        os.replace(tmp, self._file(name))  # atomic, so concurrent processes never read partial files
+
+    def _meta(self, entry):
+        name = self._file('{}.meta.json'.format(entry))
+        if not osp.isfile(name):
+            return None
+        with open(name) as f:
+            return json.load(f)
+
+    def _write_meta(self, entry, **items):
+        items['key'] = {k: str(v) for k, v in self.key.items()}
+        tmp = self._file('{}.meta.json.{}.tmp'.format(entry, os.getpid()))
+        with open(tmp, 'w') as f:
+            json.dump(items, f)
+        os.replace(tmp, self._file('{}.meta.json'.format(entry)))
+
+    def has_alias(self):
+        return self._meta('alias') is not None
+
+    def load_alias(self):
+        self.debug("Loading alias tables from cache {}...".format(self.path))
+        tables = torch.load(self._file('alias.pt'))
+        return tables['nodes'], tables['edges']
+
+    def save_alias(self, alias_nodes, alias_edges):
+        self._save({'nodes': alias_nodes, 'edges': alias_edges}, 'alias.pt')
+        self._write_meta('alias')
+
+    def has_walks(self):
+        return self._meta('walks') is not None
+
+    def load_walks(self):
+        shards = self._meta('walks')['shards']
+        self.debug("Loading {} walk shards from cache {}...".format(shards, self.path))
+        return torch.cat([torch.load(self._file('walks_{}.pt'.format(i))) for i in range(shards)])
+
+    def save_walks(self, walks, shard_size):
+        shards = 0
+        for start in range(0, len(walks), shard_size):
+            self._save(walks[start:start + shard_size].clone(), 'walks_{}.pt'.format(shards))
+            shards += 1
+        self._write_meta('walks', shards=shards)
+
+    def debug(self, *args, **kwargs):
+        if not self.silent:
+            print(*args, **kwargs)
@@ -9,8 +9,8 @@ from time import time
 import os
 
 
-def wrapper(class_instance, epoch, walk_length):
-    return class_instance.simulate_walks_one_epoch(epoch, walk_length)
+def wrapper(class_instance, epoch, walk_length, nodes=None):
+    return class_instance.simulate_walks_one_epoch(epoch, walk_length, nodes)
 
 class BasicWalker:
     def __init__(self, G, workers, silent=False):
@@ -36,28 +36,31 @@ class BasicWalker:
                 walk.append(random.choice(cur_nbrs))
             else:
                 break
-        walk = [str(i) for i in walk]
+        look_up_dict = self.look_up_dict
+        walk = [look_up_dict[i] for i in walk]
         return walk
 
-    def simulate_walks_one_epoch(self, epoch, walk_length):
+    def simulate_walks_one_epoch(self, epoch, walk_length, nodes=None):
         stime = time()
         self.debug("Run epoch {}".format(epoch))
         # print("Run epoch {} (PID {})".format(epoch, os.getpid()))
         G = self.G
-        nodes = list(G.nodes())
-        walks = []
+        nodes = list(G.nodes()) if nodes is None else list(nodes)
         random.shuffle(nodes)
-        for node in nodes:
-            walks.append(self.rwalk(
-                    walk_length=walk_length, start_node=node))
+        walks = torch.full((len(nodes), walk_length), -1, dtype=torch.int32)  # padded with -1 at dead ends
+        for i, node in enumerate(nodes):
+            walk = self.rwalk(walk_length=walk_length, start_node=node)
+            walks[i, :len(walk)] = torch.tensor(walk, dtype=torch.int32)
         etime = time()
         self.debug("Epoch {} ends in {} seconds.".format(epoch, etime - stime))
         # print("Epoch {} (PID {}) ends in {} seconds.".format(epoch, os.getpid(), etime - stime))
         return walks
 
-    def simulate_walks(self, num_walks, walk_length):
+    def simulate_walks(self, num_walks, walk_length, nodes=None):
         """
-        Repeatedly simulate random walks from each node.
+        Repeatedly simulate random walks from each node (or from each of the given start nodes).
+        Returns an int32 tensor (num_walks * len(nodes), walk_length) of node indices
+        in look_back_list, padded with -1.
         """
 
         walks = []
@@ -69,20 +72,49 @@ class BasicWalker:
 
             walks_res = []
             for walk_iter in range(num_walks):
-                walks_res.append(pool.apply_async(wrapper, args=(self, walk_iter, walk_length, )))
+                walks_res.append(pool.apply_async(wrapper, args=(self, walk_iter, walk_length, nodes, )))
 
             pool.close()
             pool.join()
 
             for w in walks_res:
-                walks.extend(w.get())
+                walks.append(w.get())
 
         else:
             for walk_iter in range(num_walks):
-                walks.extend(self.simulate_walks_one_epoch(walk_iter, walk_length))
+                walks.append(self.simulate_walks_one_epoch(walk_iter, walk_length, nodes))
 
         # print(len(walks))
-        return walks
+        return torch.cat(walks)
+
+    def produce_walks(self, rank, walk_queue, epochs, walk_length, chunk_size, seed):
+        """
+        Put walks of the given epochs into walk_queue, chunk_size start nodes at a time.
+        """
+        random.seed(None if seed is None else seed + rank)  # forked producers must not share the parent's state
+        nodes = list(self.G.nodes())
+        for epoch in epochs:
+            random.shuffle(nodes)
+            for start in range(0, len(nodes), chunk_size):
+                chunk = nodes[start:start + chunk_size]
+                walks = torch.full((len(chunk), walk_length), -1, dtype=torch.int32)
+                for i, node in enumerate(chunk):
+                    walk = self.rwalk(walk_length=walk_length, start_node=node)
+                    walks[i, :len(walk)] = torch.tensor(walk, dtype=torch.int32)
+                walk_queue.put(walks.numpy())  # by value: the producer may exit before the chunk is consumed
+
+    def start_producers(self, walk_queue, walk_workers, num_walks, walk_length, chunk_size, seed=None):
+        """
+        Start walk_workers processes that share the num_walks walk epochs and fill walk_queue.
+        """
+        producers = []
+        for rank in range(max(1, walk_workers)):
+            p = multiprocessing.Process(target=self.produce_walks, daemon=True,
+                                        args=(rank, walk_queue, range(rank, num_walks, max(1, walk_workers)),
+                                              walk_length, chunk_size, seed))
+            p.start()
+            producers.append(p)
+        return producers
 
     def debug(self, *args, **kwargs):
         if not self.silent:
@@ -121,7 +153,7 @@ class Walker(BasicWalker):
                     walk.append(nxt)
             else:
                 break
-        walk = [str(i) for i in walk]
+        walk = [look_up_dict[i] for i in walk]
         return walk
 
     def get_alias_edge(self, src, dst):
@@ -146,6 +178,26 @@ class Walker(BasicWalker):
 
         return alias_setup(normalized_probs)
 
+    def get_alias_node(self, node):
+        """
+        Get the alias node setup lists for a given node.
+        """
+        G = self.G
+        unnormalized_probs = [G[node][nbr]['weight']
+                              for nbr in G.neighbors(node)]
+        norm_const = sum(unnormalized_probs)
+        normalized_probs = [
+            float(u_prob)/norm_const for u_prob in unnormalized_probs]
+        return alias_setup(normalized_probs)
+
+    def lazy_transition_probs(self):
+        """
+        Compute alias tables on first use only, so walks in a small region of
+        a large graph do not pay for preprocessing the whole graph.
+        """
+        self.alias_nodes = LazyTable(self.get_alias_node)
+        self.alias_edges = LazyTable(lambda edge: self.get_alias_edge(edge[0], edge[1]))
+
     def preprocess_transition_probs(self):
         """
         Preprocessing of transition probabilities for guiding the random walks.
@@ -154,12 +206,7 @@ class Walker(BasicWalker):
 
         alias_nodes = {}
         for node in G.nodes():
-            unnormalized_probs = [G[node][nbr]['weight']
-                                  for nbr in G.neighbors(node)]
-            norm_const = sum(unnormalized_probs)
-            normalized_probs = [
-                float(u_prob)/norm_const for u_prob in unnormalized_probs]
-            alias_nodes[node] = alias_setup(normalized_probs)
+            alias_nodes[node] = self.get_alias_node(node)
 
         alias_edges = {}
         triads = {}
@@ -178,6 +225,20 @@ class Walker(BasicWalker):
         if not self.silent:
             print(*args, **kwargs)
 
+class LazyTable(dict):
+    """
+    A dict whose missing entries are computed by `func(key)` and stored.
+    """
+    def __init__(self, func):
+        super(LazyTable, self).__init__()
+        self.func = func
+
+    def __missing__(self, key):
+        value = self.func(key)
+        self[key] = value
+        return value
+
+
 def alias_setup(probs):
     """
     Compute utility lists for non-uniform sampling from discrete distributions.
@@ -0,0 +1,79 @@
+import numpy as np
+import torch
+from openne.models.factorization import FactorizationCache
+
+
+class FakeGraph:
+    def fingerprint(self):
+        return 'fake-graph'
+
+
+def hope_factors(rank):
+    rng = np.random.RandomState(rank)
+    return rng.rand(5, rank), rng.rand(rank), rng.rand(rank, 5)
+
+
+def grarep_factors(rank):
+    rng = np.random.RandomState(rank)
+    return [(rng.rand(5, rank), rng.rand(rank)) for _ in range(2)]
+
+
+class Counter:
+    def __init__(self, compute):
+        self.compute = compute
+        self.calls = []
+
+    def __call__(self, rank):
+        self.calls.append(rank)
+        return self.compute(rank)
+
+
+def assert_same(a, b):
+    assert type(a) is type(b)
+    if isinstance(a, (list, tuple)):
+        assert len(a) == len(b)
+        for x, y in zip(a, b):
+            assert_same(x, y)
+    elif torch.is_tensor(a):
+        assert torch.equal(a, b)
+    else:
+        np.testing.assert_array_equal(a, b)
+
+
+def test_numpy_factors_round_trip(tmp_path):
+    for compute in (hope_factors, grarep_factors):
+        cache = FactorizationCache(str(tmp_path), FakeGraph(), compute.__name__, silent=True, beta=0.1)
+        counter = Counter(compute)
+        missed = cache.get(4, counter, cache_rank=6)  # miss: computed at cache_rank and stored
+        assert counter.calls == [6]
+        hit = cache.get(4, counter)  # hit: loaded from disk, not recomputed
+        assert counter.calls == [6]
+        assert_same(missed, hit)
+        assert_same(compute(6), hit)
+
+
+def test_tensor_factors_round_trip(tmp_path):
+    cache = FactorizationCache(str(tmp_path), FakeGraph(), 'lap', silent=True)
+    counter = Counter(lambda rank: torch.arange(5 * rank, dtype=torch.float64).reshape(5, rank))
+    missed = cache.get(3, counter)
+    hit = cache.get(2, counter)
+    assert counter.calls == [3]
+    assert_same(missed, hit)
+
+
+def test_larger_rank_is_recomputed(tmp_path):
+    cache = FactorizationCache(str(tmp_path), FakeGraph(), 'hope', silent=True)
+    counter = Counter(hope_factors)
+    cache.get(2, counter)
+    assert cache.get(3, counter)[1].shape == (3,)
+    assert counter.calls == [2, 3]
+    cache.get(3, counter)
+    assert counter.calls == [2, 3]
+
+
+def test_no_root_computes_every_time():
+    cache = FactorizationCache(None, FakeGraph(), 'hope', silent=True)
+    counter = Counter(hope_factors)
+    cache.get(2, counter)
+    cache.get(2, counter)
+    assert counter.calls == [2, 2]